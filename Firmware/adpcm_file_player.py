@@ -0,0 +1,235 @@
+import gc
+import struct
+import micropython
+from array import array
+
+# File layout written by misc/wave-converter.py --adpcm:
+#   header  '<4sBBHII'  magic b'IMA1', channels, reserved, block_frames,
+#                       sample_rate, total_frames
+#   blocks  per channel '<hBB' (predictor, step index, pad), then block_frames
+#           4-bit codes: stereo packs one frame per byte (left in the low
+#           nibble), mono two frames per byte (first frame in the low nibble).
+#           Each block header holds the decoder state at its first frame, so
+#           any block (and the loop back to block 0) decodes on its own.
+ADPCM_MAGIC = b'IMA1'
+ADPCM_HEADER = '<4sBBHII'
+ADPCM_HEADER_SIZE = 16
+
+_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767)
+
+# decoder state block layout shared with _viper_ima_decode
+_ST_PRED_L = 0
+_ST_INDEX_L = 1
+_ST_PRED_R = 2
+_ST_INDEX_R = 3
+_ST_CHANNELS = 4
+_ST_BLOCK_FRAME = 5
+_ST_DST_FRAME = 6
+_ST_COUNT = 7
+
+# --------------------
+# IMA-ADPCM block decoder writing 32-bit stereo frames (mono is duplicated).
+# Decodes st[_ST_COUNT] frames from block position st[_ST_BLOCK_FRAME] of src
+# into dst starting at frame st[_ST_DST_FRAME]; at block position 0 the
+# predictor/step index are loaded from the block header first.
+@micropython.viper
+def _viper_ima_decode(dst: ptr32, src: ptr8, steps: ptr16, st: ptr32):
+    ch = st[4]
+    f = st[5]
+    o = st[6]
+    end = o + st[7]
+    if f == 0:
+        st[0] = ((src[0] | (src[1] << 8)) ^ 0x8000) - 0x8000
+        st[1] = src[2]
+        if ch == 2:
+            st[2] = ((src[4] | (src[5] << 8)) ^ 0x8000) - 0x8000
+            st[3] = src[6]
+    pl = st[0]
+    il = st[1]
+    pr = st[2]
+    ir = st[3]
+    data = ch * 4
+    b = 0
+    while o < end:
+        if ch == 2:
+            b = src[data + f]
+            code = b & 0xF
+        else:
+            code = (src[data + (f >> 1)] >> ((f & 1) << 2)) & 0xF
+        # left (or mono)
+        step = steps[il]
+        d = step >> 3
+        if code & 4:
+            d += step
+        if code & 2:
+            d += step >> 1
+        if code & 1:
+            d += step >> 2
+        if code & 8:
+            pl -= d
+        else:
+            pl += d
+        if pl > 32767:
+            pl = 32767
+        elif pl < -32768:
+            pl = -32768
+        c = code & 7
+        if c < 4:
+            il -= 1
+        else:
+            il += (c - 3) << 1
+        if il < 0:
+            il = 0
+        elif il > 88:
+            il = 88
+        if ch == 2:
+            # right
+            code = b >> 4
+            step = steps[ir]
+            d = step >> 3
+            if code & 4:
+                d += step
+            if code & 2:
+                d += step >> 1
+            if code & 1:
+                d += step >> 2
+            if code & 8:
+                pr -= d
+            else:
+                pr += d
+            if pr > 32767:
+                pr = 32767
+            elif pr < -32768:
+                pr = -32768
+            c = code & 7
+            if c < 4:
+                ir -= 1
+            else:
+                ir += (c - 3) << 1
+            if ir < 0:
+                ir = 0
+            elif ir > 88:
+                ir = 88
+        else:
+            pr = pl
+        dst[o] = (pl & 0xFFFF) | (pr << 16)
+        f += 1
+        o += 1
+    st[0] = pl
+    st[1] = il
+    st[2] = pr
+    st[3] = ir
+    st[5] = f
+    st[6] = o
+
+
+class AdpcmFilePlayer:
+    """
+    Streaming IMA-ADPCM player (4:1 compressed stimuli from
+    misc/wave-converter.py --adpcm) with the same generate_buffer(desired_frames)
+    contract as RawFilePlayer, looping at the end of the file.
+
+    One compressed block at a time is read with readinto() into a preallocated
+    buffer and decoded in viper straight into the stereo output buffer, so flash
+    reads drop 4x against raw 16-bit PCM and streaming allocates nothing.
+
+    The file's sample rate must match config["audio"]; output is 16-bit stereo
+    (mono files are duplicated to both channels). Returned buffers are only
+    valid until the next call.
+    """
+    _steps = None
+
+    def __init__(self, filename, config):
+        self.config = config
+        self.audio_cfg = config["audio"]
+        self.filename = filename
+        if self.audio_cfg["bits_per_sample"] != 16 or self.audio_cfg.get("channels", 2) != 2:
+            raise ValueError("AdpcmFilePlayer produces 16-bit stereo only")
+        self.frame_size = 4
+
+        if AdpcmFilePlayer._steps is None:
+            AdpcmFilePlayer._steps = array('H', _STEPS)
+
+        self.file = open(filename, "rb")
+        header = self.file.read(ADPCM_HEADER_SIZE)
+        if len(header) < ADPCM_HEADER_SIZE:
+            self.file.close()
+            raise ValueError(f"{filename}: not an IMA-ADPCM file")
+        magic, channels, _, block_frames, sample_rate, total_frames = struct.unpack(ADPCM_HEADER, header)
+        if magic != ADPCM_MAGIC or channels not in (1, 2) or not block_frames or not total_frames:
+            self.file.close()
+            raise ValueError(f"{filename}: not an IMA-ADPCM file")
+        if sample_rate != self.audio_cfg["sample_rate"]:
+            self.file.close()
+            raise ValueError(f"{filename}: sample rate {sample_rate} Hz does not match "
+                             f"audio.sample_rate {self.audio_cfg['sample_rate']} Hz")
+        self.channels = channels
+        self.block_frames = block_frames
+        self.total_frames = total_frames
+        self.sample_rate = sample_rate
+        self.num_blocks = (total_frames + block_frames - 1) // block_frames
+        # mono blocks hold two codes per byte
+        self.block_bytes = 4 * channels + (block_frames * channels + 1) // 2
+
+        gc.collect()
+        self.block = bytearray(self.block_bytes)
+        self.state = array('i', [0, 0, 0, 0, channels, 0, 0, 0])
+        self.block_index = -1
+        self.block_len = 0  # frames in the loaded block
+
+        # Output buffer (allocated on first generate_buffer call)
+        self.buffer = None
+        self.view = None
+        self.buf_bytes = 0
+
+    def close(self):
+        """Release the file handle (the player can't stream afterwards)."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def rewind(self):
+        """Restart from the first frame (the next buffer reloads block 0)"""
+        self.block_index = -1
+        self.block_len = 0
+        self.state[_ST_BLOCK_FRAME] = 0
+
+    def _load_block(self, index):
+        """Read block 'index' into the block buffer and rewind the decoder to its start"""
+        if index >= self.num_blocks:
+            index = 0
+        if index != self.block_index + 1 or index == 0:
+            self.file.seek(ADPCM_HEADER_SIZE + index * self.block_bytes)
+        self.file.readinto(self.block)
+        self.block_index = index
+        self.block_len = min(self.block_frames, self.total_frames - index * self.block_frames)
+        self.state[_ST_BLOCK_FRAME] = 0
+
+    def generate_buffer(self, desired_frames):
+        """
+        Returns a memoryview for the next stereo buffer of 'desired_frames'.
+        """
+        num_bytes = desired_frames * self.frame_size
+        if self.buf_bytes != num_bytes:
+            self.buffer = bytearray(num_bytes)
+            self.view = memoryview(self.buffer)
+            self.buf_bytes = num_bytes
+
+        st = self.state
+        done = 0
+        while done < desired_frames:
+            if st[_ST_BLOCK_FRAME] >= self.block_len:
+                self._load_block(self.block_index + 1)
+            n = min(desired_frames - done, self.block_len - st[_ST_BLOCK_FRAME])
+            st[_ST_DST_FRAME] = done
+            st[_ST_COUNT] = n
+            _viper_ima_decode(self.buffer, self.block, AdpcmFilePlayer._steps, st)
+            done += n
+        return self.view
@@ -0,0 +1,262 @@
+import asyncio
+import gc
+from array import array
+
+# ring index words (see SPSCRing.idx): each side only ever writes its own word
+_HEAD = 0   # next slot to produce, written by the producer only
+_TAIL = 1   # next slot to consume, written by the consumer only
+
+# occupancy / stall counters (see SPSCRing.stats)
+_S_MIN = 0
+_S_MAX = 1
+_S_SUM = 2
+_S_N = 3
+_S_UNDERRUNS = 4
+_S_FULL = 5
+
+# producer stop requests (see Producer.request_stop)
+STOP_NONE = 0
+STOP_FADE = 1
+STOP_IMMEDIATE = 2
+
+# volume change request words (see Producer.request_volume)
+_V_SEQ = 0      # even: stable, odd: update in progress
+_V_LEFT = 1     # Q15 segment volumes
+_V_RIGHT = 2
+_V_RAMP_MS = 3
+
+
+class SPSCRing:
+    """
+    Lock-free single-producer / single-consumer ring of preallocated audio buffers.
+
+    Head and tail are counters modulo 2 * slots kept in an integer array: the
+    producer only stores the head word and the consumer only stores the tail word,
+    so the two cores never need a lock. Occupancy is sampled every time the
+    consumer takes a slot. A slot may be committed short (a segment's last
+    buffer); its byte count travels with it in 'lengths'.
+    """
+    def __init__(self, slots, buf_bytes):
+        self.slots = slots
+        self.buf_bytes = buf_bytes
+        self.bufs = [bytearray(buf_bytes) for _ in range(slots)]
+        self.views = [memoryview(b) for b in self.bufs]
+        self.lengths = array('i', [buf_bytes] * slots)
+        self.idx = array('i', [0, 0])
+        self.stats = array('i', [0, 0, 0, 0, 0, 0])
+        self.reset()
+
+    def reset(self):
+        """Empty the ring and clear its statistics (only while both sides are idle)"""
+        self.idx[_HEAD] = 0
+        self.idx[_TAIL] = 0
+        st = self.stats
+        st[_S_MIN] = self.slots
+        for i in range(1, len(st)):
+            st[i] = 0
+
+    def occupancy(self):
+        return (self.idx[_HEAD] - self.idx[_TAIL]) % (2 * self.slots)
+
+    # --- producer side ---
+    def producer_slot(self):
+        """The next free buffer to fill, or None when the ring is full"""
+        if self.occupancy() >= self.slots:
+            self.stats[_S_FULL] += 1
+            return None
+        return self.bufs[self.idx[_HEAD] % self.slots]
+
+    def commit(self, nbytes):
+        """Publish the first nbytes of the slot returned by producer_slot()"""
+        self.lengths[self.idx[_HEAD] % self.slots] = nbytes
+        self.idx[_HEAD] = (self.idx[_HEAD] + 1) % (2 * self.slots)
+
+    # --- consumer side ---
+    def consumer_view(self):
+        """The oldest filled buffer, or None when the ring is empty"""
+        occ = self.occupancy()
+        if occ == 0:
+            return None
+        st = self.stats
+        if occ < st[_S_MIN]:
+            st[_S_MIN] = occ
+        if occ > st[_S_MAX]:
+            st[_S_MAX] = occ
+        if st[_S_SUM] > 0x1FFFFFFF:
+            st[_S_SUM] >>= 1
+            st[_S_N] >>= 1
+        st[_S_SUM] += occ
+        st[_S_N] += 1
+        i = self.idx[_TAIL] % self.slots
+        n = self.lengths[i]
+        return self.views[i] if n == self.buf_bytes else self.views[i][:n]
+
+    def release(self):
+        """Hand the slot returned by consumer_view() back to the producer"""
+        self.idx[_TAIL] = (self.idx[_TAIL] + 1) % (2 * self.slots)
+
+    def underrun(self):
+        self.stats[_S_UNDERRUNS] += 1
+
+    def snapshot(self):
+        """Occupancy statistics as a JSON-ready dict"""
+        st = self.stats
+        return {
+            'slots': self.slots,
+            'occupancy': self.occupancy(),
+            'min_occupancy': st[_S_MIN] if st[_S_N] else None,
+            'max_occupancy': st[_S_MAX],
+            'avg_occupancy': st[_S_SUM] / st[_S_N] if st[_S_N] else None,
+            'underruns': st[_S_UNDERRUNS],
+            'producer_full': st[_S_FULL]
+        }
+
+
+class Producer:
+    """
+    Producer half of the pipelined playback mode (see HardwareController.play_pipelined).
+
+    Reads and scales wave generator buffers into an SPSCRing using the hardware
+    controller's gain block, handles segment splicing, durations and the release
+    ramp, and marks the stream done once its last buffer is published. It runs
+    either as an asyncio task next to the network loop on core 1 (run()) or is
+    stepped from core 0 while the I2S IRQ consumes the ring (step()).
+    """
+    def __init__(self, hw):
+        self.hw = hw
+        self.ring = None
+        self.active = False
+        self.done = True
+        self.stop = STOP_NONE
+        self.generator = None
+        self.frames = 0
+        self.frame_bytes = 4
+        self.remaining = -1
+        self.tail = -1
+        self.release_frames = 0
+        self.next_segment = None
+        # Mid-stream volume changes from the consumer, applied by the producer
+        # (a seqlock like control_block.ControlBlock: one writer, one reader)
+        self.volume = array('i', [0, 32767, 32767, 0])
+        self.volume_seen = 0
+
+    def prepare(self, slots, frames, frame_bytes):
+        """(Re)allocate the ring only when its geometry changes"""
+        buf_bytes = frames * frame_bytes
+        if self.ring is None or self.ring.slots != slots or self.ring.buf_bytes != buf_bytes:
+            self.ring = None
+            gc.collect()
+            self.ring = SPSCRing(slots, buf_bytes)
+        self.ring.reset()
+        return self.ring
+
+    def start(self, wave_generator, frames, duration_seconds, release_frames, next_segment):
+        """Arm the producer; 'active' is set last so the other core sees a complete setup"""
+        self.generator = wave_generator
+        self.frames = frames
+        self.frame_bytes = self.ring.buf_bytes // frames
+        self.remaining = self.hw._duration_frames(duration_seconds)
+        self.tail = -1
+        self.release_frames = release_frames
+        self.next_segment = next_segment
+        self.volume_seen = self.volume[_V_SEQ]
+        self.stop = STOP_NONE
+        self.done = False
+        self.active = True
+
+    def request_stop(self, stop):
+        """Called by the consumer: "fade" ends through the release ramp, "immediate" at once"""
+        self.stop = STOP_IMMEDIATE if stop == "immediate" else STOP_FADE
+
+    def request_volume(self, volume_left, volume_right=None, ramp_ms=0):
+        """
+        Called by the consumer: ramp to new segment volumes (floats in [0.0, 1.0])
+        from the next produced buffer. The scaler writes the gain block back after
+        every buffer, so while a stream runs only the producer may change it.
+        """
+        if volume_right is None:
+            volume_right = volume_left
+        v = self.volume
+        v[_V_SEQ] += 1
+        v[_V_LEFT] = max(0, min(int(volume_left * 32767), 32767))
+        v[_V_RIGHT] = max(0, min(int(volume_right * 32767), 32767))
+        v[_V_RAMP_MS] = ramp_ms
+        v[_V_SEQ] += 1
+
+    def _poll_volume(self):
+        """Apply a complete, new volume request to the gain block"""
+        v = self.volume
+        seq = v[_V_SEQ]
+        if seq == self.volume_seen or seq & 1:
+            return
+        left = v[_V_LEFT]
+        right = v[_V_RIGHT]
+        ramp_ms = v[_V_RAMP_MS]
+        if v[_V_SEQ] != seq:
+            return  # torn by a concurrent request: retry at the next buffer
+        self.volume_seen = seq
+        hw = self.hw
+        hw._volume_l = left
+        hw._volume_r = right
+        hw._ramp_output(hw._ms_to_frames(ramp_ms))
+
+    def _finish(self):
+        self.active = False
+        self.done = True
+
+    def step(self):
+        """Fill every free slot of the ring; returns once it is full or the stream ends"""
+        if not self.active:
+            return
+        hw = self.hw
+        ring = self.ring
+        while True:
+            if self.stop == STOP_IMMEDIATE:
+                self._finish()
+                return
+            buf = ring.producer_slot()
+            if buf is None:
+                return
+
+            if self.tail < 0:
+                self._poll_volume()
+                hw.apply_control()
+                if self.remaining == 0 and not self.stop and self.next_segment is not None:
+                    # segment done: splice in the next one, if any
+                    segment = self.next_segment()
+                    if segment is not None:
+                        self.generator, duration_seconds, vl, vr = segment
+                        hw.set_volume(vl, vr, hw.audio.get("volume_ramp_ms", 0))
+                        self.remaining = self.hw._duration_frames(duration_seconds)
+                if self.stop or self.remaining == 0:
+                    # release ramp (if any), followed by silence that flushes the
+                    # DMA buffer, so the last stimulus frames play before the mute
+                    hw._ramp_q15(0, 0, self.release_frames)
+                    self.tail = hw._release_buffers(self.release_frames, self.frames)
+            if self.tail == 0:
+                self._finish()
+                return
+            if self.tail > 0:
+                self.tail -= 1
+
+            # a segment's last buffer is cut to its remaining frames, as in play_audio
+            raw = self.generator.generate_buffer(self.frames)
+            n = self.frames if self.remaining <= 0 else min(self.frames, self.remaining)
+            if n < self.frames:
+                raw = raw[:n * self.frame_bytes]
+            if hw._apply_gains(buf, raw) is raw:
+                buf[:len(raw)] = raw
+            ring.commit(len(raw))
+            if self.remaining > 0:
+                self.remaining -= n
+
+    async def run(self, poll_ms=1, idle_ms=5):
+        """Core-1 producer task: keep the ring full while a stream is active"""
+        while True:
+            if self.active:
+                try:
+                    self.step()
+                except Exception as e:
+                    print(f"Error in audio producer: {e}")
+                    self._finish()
+            await asyncio.sleep_ms(poll_ms if self.active else idle_ms)
@@ -0,0 +1,72 @@
+from array import array
+
+# block layout (see ControlBlock.words)
+C_SEQ = 0       # even: stable, odd: update in progress
+C_VOLUME = 1    # Q15 master volume for both channels; -1 follows the segment volumes
+C_BALANCE = 2   # Q15 L/R balance: -32767 left only .. 0 centre .. 32767 right only
+C_GAIN = 3      # amplifier gain level 0..3; -1 leaves the pins alone
+C_RAMP_MS = 4   # ramp length for the volume/balance change
+_NFIELDS = 5
+
+
+class ControlBlock:
+    """
+    Live playback parameters (master volume, L/R balance, amplifier gain)
+    written by the network loop and read by the audio loop once per buffer,
+    so a change takes effect at the next buffer without restarting playback.
+
+    The block is a preallocated array guarded like a seqlock: update() makes
+    the sequence number odd, writes the fields, then makes it even again;
+    poll() copies the fields into 'values' and keeps the copy only if the
+    sequence number was even and unchanged across the copy. Neither side takes
+    a lock or allocates, so poll() is safe on core 0 and in the I2S IRQ while
+    core 1 writes.
+
+    Single writer (the network loop), single reader (whichever of the main
+    loop, I2S IRQ or pipeline producer is running the audio at the time).
+    """
+    def __init__(self):
+        self.words = array('i', [0, -1, 0, -1, 0])
+        self.values = array('i', [0, -1, 0, -1, 0])
+        self.seen = 0
+
+    def update(self, volume=None, balance=None, gain=None, ramp_ms=0):
+        """
+        Publish new parameters; None leaves a field unchanged. volume is a float
+        in [0.0, 1.0] (negative: follow the segment volumes again), balance a
+        float in [-1.0, 1.0], gain a level 0..3.
+        """
+        w = self.words
+        w[C_SEQ] += 1
+        if volume is not None:
+            w[C_VOLUME] = -1 if volume < 0 else max(0, min(int(volume * 32767), 32767))
+        if balance is not None:
+            w[C_BALANCE] = max(-32767, min(int(balance * 32767), 32767))
+        if gain is not None:
+            w[C_GAIN] = gain
+        w[C_RAMP_MS] = ramp_ms
+        w[C_SEQ] += 1
+
+    def poll(self):
+        """Copy a changed, consistent block into 'values'; returns True if there was a change"""
+        w = self.words
+        seq = w[C_SEQ]
+        if seq == self.seen or seq & 1:
+            return False
+        v = self.values
+        for i in range(1, _NFIELDS):
+            v[i] = w[i]
+        if w[C_SEQ] != seq:
+            return False  # torn by a concurrent update: retry at the next buffer
+        self.seen = seq
+        return True
+
+    def snapshot(self):
+        """The published parameters as a JSON-ready dict"""
+        w = self.words
+        return {
+            'volume': w[C_VOLUME] / 32767 if w[C_VOLUME] >= 0 else None,
+            'balance': w[C_BALANCE] / 32767,
+            'gain': w[C_GAIN] if w[C_GAIN] >= 0 else None,
+            'ramp_ms': w[C_RAMP_MS]
+        }
@@ -1,36 +1,80 @@
 from machine import Pin, I2S
+from array import array
 import time, gc
 import micropython
+from trace_ring import TraceRing
+from metrics import Metrics, GAP_EDGES_US
+from audio_pipeline import Producer
+from control_block import ControlBlock, C_VOLUME, C_BALANCE, C_GAIN, C_RAMP_MS
 
 # --------------------
-# fixed‑point scaler: in-place scale of signed 16‑bit samples
-# scale a bytearray in-place, sample‑wise, with fixed-point Q15 volume
+# fixed‑point stereo scaler: one 32‑bit word per 16‑bit L/R frame
+# scale frames from src into dst with independent Q15 gains (dst may alias src),
+# interpolating the gains per frame so volume changes ramp without clicks.
+# gains is a ptr32 block (see _GAIN_* indices):
+#   [acc_left, acc_right, step_left, step_right, ramp_frames, target_left, target_right]
+# acc_* are Q15 gains << 16; while ramp_frames > 0 each frame adds step_* and the
+# last ramp frame snaps to target_* (Q15) exactly.
 @micropython.viper
-def _viper_scale16(buf: ptr8, n: int, vol_q15: int):
+def _viper_scale_stereo(dst: ptr32, src: ptr32, frames: int, gains: ptr32):
+    al = gains[0]
+    ar = gains[1]
+    sl = gains[2]
+    sr = gains[3]
+    remaining = gains[4]
+    gl = al >> 16
+    gr = ar >> 16
     i = int(0)
-    # n = number of 16‑bit samples; buf is ptr8 to bytes
-    while i < n:
-        off = i * 2
-        lo = buf[off]              # low byte
-        hi = buf[off + 1]          # high byte
-        raw = lo | (hi << 8)       # assemble little‑endian word
-        # signed conversion
-        if raw & 0x8000:
-            s = raw - 0x10000
-        else:
-            s = raw
+    while i < frames:
+        if remaining > 0:
+            al += sl
+            ar += sr
+            remaining -= 1
+            if remaining == 0:
+                al = gains[5] << 16
+                ar = gains[6] << 16
+            gl = al >> 16
+            gr = ar >> 16
+        w = src[i]                              # little‑endian: L in low half, R in high half
+        l = ((w & 0xFFFF) ^ 0x8000) - 0x8000    # sign‑extend low half
+        r = w >> 16                             # arithmetic shift keeps the sign
         # Q15 scale
-        s = (s * vol_q15) >> 15
-        # clamp
-        if s < -32768:
-            s = -32768
-        elif s > 32767:
-            s = 32767
-        # write back
-        v = s & 0xFFFF
-        buf[off]     = v & 0xFF
-        buf[off + 1] = (v >> 8) & 0xFF
+        l = (l * gl) >> 15
+        r = (r * gr) >> 15
+        # saturate
+        if l > 32767:
+            l = 32767
+        elif l < -32768:
+            l = -32768
+        if r > 32767:
+            r = 32767
+        elif r < -32768:
+            r = -32768
+        dst[i] = (l & 0xFFFF) | (r << 16)
         i += 1
+    gains[0] = al
+    gains[1] = ar
+    gains[4] = remaining
+
+
+# gain block layout shared with _viper_scale_stereo
+_GAIN_ACC_L = 0
+_GAIN_ACC_R = 1
+_GAIN_STEP_L = 2
+_GAIN_STEP_R = 3
+_GAIN_RAMP = 4
+_GAIN_TARGET_L = 5
+_GAIN_TARGET_R = 6
+
+
+def _q15(volume):
+    """Convert a float volume in [0.0, 1.0] to a clamped Q15 integer."""
+    q = int(volume * 32767)
+    if q < 0:
+        return 0
+    if q > 32767:
+        return 32767
+    return q
 
 
 # --------------------
@@ -42,6 +86,61 @@ class HardwareController:
         self.led = Pin(config["pins"]["led"], Pin.OUT)
         self.i2s = None
 
+        # Reusable output buffer for scaled samples (see _output_buffer)
+        self._out_buf = None
+
+        # Q15 gain/envelope block shared with the viper scaler (see _GAIN_*)
+        self._gains = array('i', [32767 << 16, 32767 << 16, 0, 0, 0, 32767, 32767])
+        self._unity = True
+        # Segment volumes (Q15) before the live control block is applied
+        self._volume_l = 32767
+        self._volume_r = 32767
+        # Live volume/balance/gain written by the network loop (see apply_control)
+        self.control = ControlBlock()
+        self.gain_level = None
+        self._control_volume = -1
+        self._control_balance = 0
+
+        # Interrupt-driven playback state (see start_playback)
+        self.playing = False
+        self._irq_pool = []
+        self._irq_next = 0
+        self._irq_generator = None
+        self._irq_frames = 0
+        self._irq_deadline = None
+        self._irq_start_ms = 0
+        self._irq_stop = None
+        self._irq_tail = -1
+        self._irq_release_frames = 0
+        self._irq_next_segment = None
+
+        # Result of the last playback: device time the output was muted and
+        # whether it was cut short by a stop request
+        self.last_stop_us = None
+        self.last_preempted = False
+        # stimulus frames delivered by the last playback (release tail excluded),
+        # None where the mode doesn't count them
+        self.last_frames_played = None
+        # Scheduled starts: error of the last start vs. its target (+ = late)
+        self.last_start_error_us = None
+        self._silence = None
+        # bind once: referencing a bound method allocates, which an IRQ handler must not do
+        self._irq_cb = self._irq_callback
+        self._irq_last_us = 0
+
+        # Per-write trace records (drained by /trace or print_records)
+        self.trace = TraceRing(self.audio.get("trace_size", 256))
+        # Underrun / timing / heap counters (served by /metrics)
+        self.metrics = Metrics(self.audio.get("gap_edges_us", GAP_EDGES_US))
+
+        # Pipelined playback (see play_pipelined): producer filling an SPSC ring
+        self.producer = Producer(self)
+        self._pipeline_inflight = False
+        self._pipeline_cb = self._pipeline_irq
+        # Consumer-side release ramp over buffers already in the ring (see _start_fade)
+        self._fade = array('i', [0, 0, 0, 0, 0, 0, 0])
+        self._pipeline_fade = -1
+
         self.dac_mute = Pin(config["pins"]["mute"], Pin.OUT)
         self.amp_gain0 = Pin(config["pins"]["amp_gain0"], Pin.OUT)
         self.amp_gain1 = Pin(config["pins"]["amp_gain1"], Pin.OUT)
@@ -73,9 +172,13 @@ class HardwareController:
         """
         if gain_level < 0 or gain_level > 3:
             raise ValueError("Gain level must be between 0 and 3")
+        self._gain_pins(gain_level)
+        print(f"Amplifier gain set to level {gain_level}")        
+
+    def _gain_pins(self, gain_level):
         self.amp_gain0.value(gain_level & 0x01)
         self.amp_gain1.value((gain_level >> 1) & 0x01)
-        print(f"Amplifier gain set to level {gain_level}")        
+        self.gain_level = gain_level
 
     def initialize_i2s(self):
         """
@@ -107,20 +210,238 @@ class HardwareController:
         )
 
 
+    def _ms_to_frames(self, ms):
+        return (self.audio["sample_rate"] * ms) // 1000
+
+    def _duration_frames(self, duration_seconds):
+        """
+        Frame count for a duration in seconds; -1 (play until stopped) for None,
+        the only open-ended duration. Negative or non-finite values raise ValueError.
+        """
+        if duration_seconds is None:
+            return -1
+        if not 0 <= duration_seconds < float('inf'):
+            raise ValueError(f"Invalid duration: {duration_seconds}")
+        return int(duration_seconds * self.audio["sample_rate"])
+
+    def _duration_ms(self, duration_seconds):
+        """IRQ-mode deadline in ms for a duration in seconds; None until stopped"""
+        if duration_seconds is None:
+            return None
+        return self._duration_frames(duration_seconds) * 1000 // self.audio["sample_rate"]
+
+    def _queued_frames(self, since_us):
+        """
+        Estimate of the frames still in the I2S DMA buffer: it is full when a
+        blocking write returns (at since_us) and drains at the sample rate.
+        """
+        dma_frames = self.audio.get("dma_buffer_frames", self.audio["buffer_length"])
+        drained = time.ticks_diff(time.ticks_us(), since_us) * self.audio["sample_rate"] // 1000000
+        return max(0, dma_frames - drained)
+
+    def _ramp_q15(self, gl, gr, ramp_frames=0):
+        """
+        Move the gain block towards Q15 targets gl/gr over ramp_frames frames
+        (immediately when ramp_frames is 0). The viper scaler interpolates per frame.
+        """
+        g = self._gains
+        g[_GAIN_TARGET_L] = gl
+        g[_GAIN_TARGET_R] = gr
+        if ramp_frames > 0:
+            g[_GAIN_STEP_L] = ((gl << 16) - g[_GAIN_ACC_L]) // ramp_frames
+            g[_GAIN_STEP_R] = ((gr << 16) - g[_GAIN_ACC_R]) // ramp_frames
+            g[_GAIN_RAMP] = ramp_frames
+        else:
+            g[_GAIN_RAMP] = 0
+            g[_GAIN_ACC_L] = gl << 16
+            g[_GAIN_ACC_R] = gr << 16
+            g[_GAIN_STEP_L] = 0
+            g[_GAIN_STEP_R] = 0
+        self._unity = gl == 32767 and gr == 32767
+
+    def set_volume(self, volume_left, volume_right=None, ramp_ms=0):
+        """
+        Set per-channel playback volume (floats in [0.0, 1.0]).
+        volume_right defaults to volume_left. With ramp_ms > 0 the change is
+        interpolated sample by sample, so it is safe to call mid-stream.
+        The live control block's master volume and balance apply on top.
+        """
+        if volume_right is None:
+            volume_right = volume_left
+        self._volume_l = _q15(volume_left)
+        self._volume_r = _q15(volume_right)
+        self._ramp_output(self._ms_to_frames(ramp_ms))
+
+    def _ramp_output(self, ramp_frames):
+        """Ramp to the segment volumes (or the master volume) with the balance applied"""
+        v = self.control.values
+        gl = self._volume_l
+        gr = self._volume_r
+        if v[C_VOLUME] >= 0:
+            gl = gr = v[C_VOLUME]
+        b = v[C_BALANCE]
+        if b > 0:
+            gl = (gl * (32767 - b)) >> 15
+        elif b < 0:
+            gr = (gr * (32767 + b)) >> 15
+        self._ramp_q15(gl, gr, ramp_frames)
+
+    def apply_control(self):
+        """
+        Apply a changed control block: amplifier gain pins at once, volume and
+        balance as a ramp over its ramp_ms. Called once per buffer by whichever
+        loop is producing audio (and by the idle main loop), so changes land
+        within one buffer without restarting playback. Must not be called
+        during a release ramp.
+        """
+        if not self.control.poll():
+            return
+        v = self.control.values
+        if v[C_GAIN] >= 0 and v[C_GAIN] != self.gain_level:
+            self._gain_pins(v[C_GAIN])
+        # a gain-only update must not cut short a ramp in progress
+        if v[C_VOLUME] != self._control_volume or v[C_BALANCE] != self._control_balance:
+            self._control_volume = v[C_VOLUME]
+            self._control_balance = v[C_BALANCE]
+            self._ramp_output(self._ms_to_frames(v[C_RAMP_MS]))
+
+    def _apply_gains(self, dst, src):
+        """Scale one stereo buffer from src into dst; returns the buffer to write (len(src) bytes)."""
+        if self._unity and self._gains[_GAIN_RAMP] == 0:
+            return src
+        _viper_scale_stereo(dst, src, len(src) // 4, self._gains)
+        return dst if len(dst) == len(src) else memoryview(dst)[:len(src)]
+
+    def _start_envelope(self, volume_left, volume_right, attack_ms):
+        """Start from silence and ramp up to the playback volume over attack_ms."""
+        self._ramp_q15(0, 0)
+        self.set_volume(volume_left, volume_right, attack_ms)
+
+    def _release_buffers(self, release_frames, playback_frames):
+        """
+        Number of buffers to render after a release starts: the ramp itself plus
+        enough silence to flush the I2S DMA buffer before the output is muted.
+        """
+        dma_frames = self.audio.get("dma_buffer_frames", self.audio["buffer_length"])
+        return (release_frames + dma_frames + playback_frames - 1) // playback_frames
+
+    def _start_fade(self, release_frames):
+        """
+        Load the consumer-side release block: unity down to silence over
+        release_frames (straight silence for 0). Pipelined playback applies it in
+        place to ring buffers that were produced before a stop, so the fade starts
+        at the next buffer instead of after the ring has drained.
+        """
+        f = self._fade
+        if release_frames > 0:
+            f[_GAIN_ACC_L] = 32767 << 16
+            f[_GAIN_STEP_L] = -(32767 << 16) // release_frames
+        else:
+            f[_GAIN_ACC_L] = 0
+            f[_GAIN_STEP_L] = 0
+        f[_GAIN_ACC_R] = f[_GAIN_ACC_L]
+        f[_GAIN_STEP_R] = f[_GAIN_STEP_L]
+        f[_GAIN_RAMP] = max(release_frames, 0)
+        f[_GAIN_TARGET_L] = 0
+        f[_GAIN_TARGET_R] = 0
+
+    def _wait_until(self, start_at_us, stop_check=None):
+        """
+        Schedule the first frame of a playback at device time start_at_us (ticks_us).
+
+        Sleeps with the output muted until shortly before the target
+        (audio.schedule_lead_us), unmutes, then writes just enough silence that the
+        first real frame reaches the DAC at the target, minus the fixed output
+        pipeline delay audio.output_latency_us. The rest is clocked by the I2S
+        sample clock, so start-time jitter is below one frame period plus timer
+        resolution. Assumes the I2S buffer is idle (drained).
+
+        Returns False (still muted) if stop_check asked to stop while waiting.
+        """
+        rate = self.audio["sample_rate"]
+        lead_us = self.audio.get("schedule_lead_us", 20000)
+        target = time.ticks_add(start_at_us, -self.audio.get("output_latency_us", 0))
+
+        while time.ticks_diff(target, time.ticks_us()) > lead_us:
+            if stop_check is not None and stop_check():
+                return False
+            time.sleep_ms(1)
+
+        self.enable_audio()
+        remaining = time.ticks_diff(target, time.ticks_us())
+        if remaining <= 0:
+            self.last_start_error_us = -remaining
+            return True
+
+        # silence pad, written in chunks of a reused zeroed buffer
+        pad_bytes = (remaining * rate // 1000000) * 4
+        if self._silence is None:
+            self._silence = bytearray(4096)
+        silence = memoryview(self._silence)
+        while pad_bytes > 0:
+            n = min(pad_bytes, len(silence))
+            self.i2s.write(silence[:n])
+            pad_bytes -= n
+        self.last_start_error_us = 0
+        return True
+
+    def _output_buffer(self, nbytes):
+        """Return the cached output bytearray, reallocating only when the size changes."""
+        if self._out_buf is None or len(self._out_buf) != nbytes:
+            self._out_buf = None
+            gc.collect()
+            self._out_buf = bytearray(nbytes)
+        return self._out_buf
+
     def play_audio(self,
                    wave_generator,
                    playback_frames=None,
                    aggregate_count=16,
                    debug=False,
                    duration_seconds=None,
-                   volume: float = 1.0):
+                   volume: float = 1.0,
+                   volume_left=None,
+                   volume_right=None,
+                   attack_ms=None,
+                   release_ms=None,
+                   stop_check=None,
+                   next_segment=None,
+                   start_at_us=None,
+                   volume_check=None):
         """
+        debug: print the trace ring over serial when playback ends
         volume: float in [0.0, 1.0]
+        volume_left/volume_right: per-channel overrides of volume
+        attack_ms/release_ms: fade-in/fade-out lengths (default from config["audio"])
+        stop_check: optional callable polled once per buffer; returning "fade"
+            ends playback through the release ramp, "immediate" mutes at once
+        next_segment: optional callable invoked when the current duration ends;
+            it returns (wave_generator, duration_seconds, volume_left, volume_right)
+            to continue gaplessly with the same pre-fill and amplifier state, or None
+        start_at_us: optional device ticks_us at which the first frame should play
+        volume_check: optional callable polled once per buffer; returning
+            (volume_left, volume_right, ramp_ms) ramps to a new volume mid-stream
+
+        Durations are counted in frames, pre-fill included: the last buffer of a
+        segment is cut to the exact remaining frames (the rest of that generator
+        buffer is dropped), so a segment plays duration_seconds * sample_rate
+        frames whatever the buffer size or write jitter. The output is muted only
+        after silence has flushed the DMA buffer (release_ms 0 included), so every
+        counted frame is heard; an immediate stop discounts the frames still
+        queued. The count (without the release tail) is left in
+        self.last_frames_played.
         """
         import gc, time
 
-        # pre‑compute integer Q15 volume
-        vol_q15 = int(volume * 32767)
+        if attack_ms is None:
+            attack_ms = self.audio.get("attack_ms", 0)
+        if release_ms is None:
+            release_ms = self.audio.get("release_ms", 0)
+
+        # pre‑compute integer Q15 gains, starting the attack ramp from silence
+        self._start_envelope(volume if volume_left is None else volume_left,
+                             volume if volume_right is None else volume_right,
+                             attack_ms)
 
         # 1) determine frames per write
         if playback_frames is None:
@@ -133,75 +454,619 @@ class HardwareController:
         if self.i2s is None:
             self.initialize_i2s()
 
-        # 3) free memory & enable audio
-        gc.collect()
-        self.enable_audio()
+        # Generator buffers are read-only: scaled samples go to a reused output
+        # buffer, so nothing is allocated per write once pre-fill is done.
+        frame_bytes = (self.audio['bits_per_sample'] // 8) * 2
+        expected = aggregate_count * playback_frames * frame_bytes
+        out = self._output_buffer(playback_frames * frame_bytes)
 
-        # 4) fixed‑duration?
-        if duration_seconds is not None:
-            duration_ms = int(duration_seconds * 1000)
-            start_ms = time.ticks_ms()
+        # 3) fixed‑duration? counted in frames (-1: until stopped); checked
+        # before unmuting, so a bad duration never leaves the output on
+        remaining = self._duration_frames(duration_seconds)
+        played = 0
 
-        # 5) pre‑fill 4 buffers
-        for i in range(4):
-            # always get a fresh bytearray so we can mutate it
+        # 4) free memory & enable audio (a scheduled start unmutes at the start edge)
+        gc.collect()
+        self.last_preempted = False
+        self.last_start_error_us = None
+        if start_at_us is None:
+            self.enable_audio()
+        elif not self._wait_until(start_at_us, stop_check):
+            # stopped while waiting for the scheduled start
+            self.last_preempted = True
+            self.disable_audio()
+            self.last_stop_us = time.ticks_us()
+            self.last_frames_played = 0
+            return
+        self.last_frames_played = 0
+
+        # 5) pre‑fill the DMA buffer (audio.prefill_buffers writes, part of the duration)
+        trace = self.trace
+        metrics = self.metrics
+        for i in range(self.audio.get("prefill_buffers", 4)):
+            if remaining == 0:
+                break
+            n = playback_frames if remaining < 0 else min(playback_frames, remaining)
+            ws = time.ticks_us()
             raw = wave_generator.generate_buffer(playback_frames)
-            buf = bytearray(raw)
-            if vol_q15 != 32767:
-                _viper_scale16(buf, len(buf) // 2, vol_q15)
+            buf = self._apply_gains(out, raw if n == playback_frames else raw[:n * frame_bytes])
             written = self.i2s.write(buf)
-            if debug:
-                print(f"[DEBUG] Pre‑fill #{i+1}: wrote {written}/{len(buf)} bytes")
+            trace.record(time.ticks_ms(), time.ticks_diff(time.ticks_us(), ws), 0, written, gc.mem_free())
+            played += n
+            if remaining > 0:
+                remaining -= n
 
-        last_loop = time.ticks_ms()
-        write_count = 0
-        total_dt    = 0
+        last_loop = time.ticks_us()
+
+        stop = None
 
         print(f"Starting audio output{' for '+str(duration_seconds)+'s' if duration_seconds else ''}...")
         try:
-            while (duration_seconds is None or
-                   time.ticks_diff(time.ticks_ms(), start_ms) < duration_ms):
+            while True:
+                if remaining == 0:
+                    # segment done: splice in the next one, if any
+                    segment = next_segment() if next_segment is not None else None
+                    if segment is None:
+                        break
+                    wave_generator, duration_seconds, vl, vr = segment
+                    self.set_volume(vl, vr, self.audio.get("volume_ramp_ms", 0))
+                    remaining = self._duration_frames(duration_seconds)
+                    if remaining == 0:
+                        continue
+
+                # preemption: checked once per buffer
+                if stop_check is not None:
+                    stop = stop_check()
+                    if stop:
+                        self.last_preempted = True
+                        break
+
+                # live volume change: ramped inside the scaler
+                if volume_check is not None:
+                    change = volume_check()
+                    if change is not None:
+                        self.set_volume(*change)
+                self.apply_control()
 
-                ws = time.ticks_ms()
+                ws = time.ticks_us()
 
-                # pull & scale each chunk
+                # pull & scale each chunk; a segment's last one is cut to its remaining frames
+                n = playback_frames if remaining < 0 else min(playback_frames, remaining)
                 raw = wave_generator.generate_buffer(playback_frames)
-                buf = bytearray(raw)
-                if vol_q15 != 32767:
-                    _viper_scale16(buf, len(buf) // 2, vol_q15)
+                buf = self._apply_gains(out, raw if n == playback_frames else raw[:n * frame_bytes])
 
                 written = self.i2s.write(buf)
-                we = time.ticks_ms()
-                dt  = time.ticks_diff(we, ws)
+                played += n
+                if remaining > 0:
+                    remaining -= n
+                we = time.ticks_us()
+                free = gc.mem_free()
+                dt = time.ticks_diff(we, ws)
                 gap = time.ticks_diff(we, last_loop)
+                want = expected if n == playback_frames else n * frame_bytes
+                # integers into preallocated arrays: no formatting on the audio path
+                trace.record(time.ticks_ms(), dt, gap, written, free)
+                metrics.write(dt, gap, written, want, free)
                 last_loop = we
-                write_count += 1
-                total_dt   += dt
-
-                if debug:
-                    print(f"[DIAG] Write#{write_count}: dt={dt}ms, gap={gap}ms, "
-                        f"bytes={written}, free={gc.mem_free()}")
 
                 # if I2S didn’t accept the full buffer, give it a moment
-                expected = (aggregate_count
-                            * playback_frames
-                            * ((self.audio['bits_per_sample'] // 8) * 2))
-                if written < expected:
-                    if debug:
-                        print("[DIAG] Incomplete write → sleep 5 ms")
+                if written < want:
                     time.sleep_ms(2)
 
-                # every 100 writes, print the average
-                if write_count % 100 == 0:
-                    avg = total_dt / write_count
-                    print(f"[DIAG] Avg write over {write_count} cycles: {avg:.2f} ms")
-
-                if gc.mem_free() < 10000:
+                if free < 10000:
                     gc.collect()
 
+            if stop != "immediate":
+                # fade out (if any), then flush the DMA buffer with silence before
+                # muting, so the last stimulus frames are played out
+                release_frames = self._ms_to_frames(release_ms)
+                self._ramp_q15(0, 0, release_frames)
+                for _ in range(self._release_buffers(release_frames, playback_frames)):
+                    self.i2s.write(self._apply_gains(out, wave_generator.generate_buffer(playback_frames)))
+            else:
+                # muted with the DMA buffer still queued: those frames never play
+                played -= min(played, self._queued_frames(last_loop))
+
         except KeyboardInterrupt:
             print("Audio playback interrupted by user")
         except Exception as e:
             print(f"Error during audio playback: {e}")
         finally:
             self.disable_audio()
+            self.last_stop_us = time.ticks_us()
+            self.last_frames_played = played
+            if debug:
+                trace.print_records()
+
+    def calibrate(self, wave_generator, candidates=None, seconds=None):
+        """
+        Find the smallest buffer configuration that streams wave_generator
+        without starving the I2S DMA buffer, with the DAC and amplifier muted.
+
+        Each candidate playback_frames (ascending) is run for 'seconds' with
+        dma_buffer_frames = playback_frames * audio.calibration_dma_ratio. A
+        blocking write returns with the DMA buffer full, so the time until the
+        next write starts (generator, scaling, GC and core-1 Wi-Fi contention)
+        must stay within audio.calibration_margin of the DMA buffer duration,
+        with no incomplete writes. Run it while the network is busy to size for
+        load. The chosen values are written into config["audio"]
+        (playback_frames, dma_buffer_frames, prefill_buffers) and I2S is
+        re-initialized with them; persisting the config is up to the caller.
+        Returns the chosen values plus per-candidate measurements. An empty or
+        invalid candidate list raises ValueError with the setup left unchanged.
+        """
+        if candidates is None:
+            candidates = self.audio.get("calibration_frames", [128, 256, 512, 1024, 2048])
+        if (not isinstance(candidates, (list, tuple)) or not candidates or
+                not all(isinstance(f, int) and f > 0 for f in candidates)):
+            raise ValueError("calibration_frames must be a non-empty list of positive frame counts")
+        if seconds is None:
+            seconds = self.audio.get("calibration_seconds", 2)
+        ratio = self.audio.get("calibration_dma_ratio", 2)
+        margin = self.audio.get("calibration_margin", 0.5)
+        frame_bytes = (self.audio['bits_per_sample'] // 8) * 2
+
+        if self.playing:
+            raise RuntimeError("Playback in progress")
+        self.disable_audio()
+        # silence: the measurement only needs the write timing
+        self._ramp_q15(0, 0)
+
+        steps = []
+        chosen = None
+        for frames in sorted(candidates):
+            dma_frames = frames * ratio
+            budget_us = int(dma_frames * 1000000 // self.audio["sample_rate"] * margin)
+            if self.i2s is not None:
+                self.i2s.deinit()
+            self.audio["dma_buffer_frames"] = dma_frames
+            self.initialize_i2s()
+            out = self._output_buffer(frames * frame_bytes)
+            expected = frames * frame_bytes
+            gc.collect()
+
+            for _ in range(ratio):
+                self.i2s.write(self._apply_gains(out, wave_generator.generate_buffer(frames)))
+
+            max_idle = 0
+            incomplete = 0
+            writes = 0
+            start_ms = time.ticks_ms()
+            last = time.ticks_us()
+            while time.ticks_diff(time.ticks_ms(), start_ms) < seconds * 1000:
+                buf = self._apply_gains(out, wave_generator.generate_buffer(frames))
+                ws = time.ticks_us()
+                idle = time.ticks_diff(ws, last)
+                written = self.i2s.write(buf)
+                last = time.ticks_us()
+                if idle > max_idle:
+                    max_idle = idle
+                if written < expected:
+                    incomplete += 1
+                writes += 1
+
+            ok = incomplete == 0 and max_idle <= budget_us
+            steps.append({'playback_frames': frames, 'dma_buffer_frames': dma_frames,
+                          'writes': writes, 'max_idle_us': max_idle,
+                          'budget_us': budget_us, 'incomplete_writes': incomplete, 'ok': ok})
+            print(f"Calibration: playback_frames={frames} dma_buffer_frames={dma_frames} "
+                  f"max_idle={max_idle}us budget={budget_us}us incomplete={incomplete} -> {'ok' if ok else 'starved'}")
+            if ok:
+                chosen = frames
+                break
+
+        # nothing passed: fall back to the largest candidate
+        if chosen is None:
+            chosen = max(candidates)
+        self.audio["playback_frames"] = chosen
+        self.audio["dma_buffer_frames"] = chosen * ratio
+        self.audio["prefill_buffers"] = ratio
+        self.i2s.deinit()
+        self.initialize_i2s()
+        self._ramp_q15(32767, 32767)
+
+        return {'ok': steps[-1]['ok'],
+                'playback_frames': chosen,
+                'dma_buffer_frames': chosen * ratio,
+                'prefill_buffers': ratio,
+                'steps': steps}
+
+    def _fill_pool_buffer(self, buf):
+        """Copy the next generator chunk into a pool buffer, scaling on the way."""
+        raw = self._irq_generator.generate_buffer(self._irq_frames)
+        if self._unity and self._gains[_GAIN_RAMP] == 0:
+            buf[:] = raw
+        else:
+            _viper_scale_stereo(buf, raw, len(buf) // 4, self._gains)
+
+    def start_playback(self,
+                       wave_generator,
+                       playback_frames=None,
+                       pool_buffers=None,
+                       duration_seconds=None,
+                       volume: float = 1.0,
+                       volume_left=None,
+                       volume_right=None,
+                       attack_ms=None,
+                       release_ms=None,
+                       next_segment=None,
+                       start_at_us=None,
+                       stop_check=None):
+        """
+        Start non-blocking playback driven by the I2S IRQ and return immediately.
+
+        A pool of preallocated buffers is filled from the wave generator; each time
+        the driver has consumed one, _irq_callback hands it the next buffer and
+        refills the one just released. The caller's loop stays free to service
+        gain and stop requests while self.playing is True. next_segment works as
+        in play_audio and is called from the IRQ handler. With start_at_us the call
+        blocks until the scheduled start (see _wait_until) before returning;
+        stop_check is polled meanwhile, and a stop returns without playing.
+        """
+        if self.playing:
+            raise RuntimeError("Playback already in progress")
+
+        if playback_frames is None:
+            playback_frames = self.audio.get(
+                "playback_frames",
+                self.audio["buffer_length"]
+            )
+        if pool_buffers is None:
+            pool_buffers = self.audio.get("irq_pool_buffers", 3)
+        if pool_buffers < 2:
+            raise ValueError("IRQ playback needs at least 2 pool buffers")
+
+        if self.i2s is None:
+            self.initialize_i2s()
+
+        # (re)allocate the pool only when its geometry changes
+        buf_bytes = playback_frames * (self.audio["bits_per_sample"] // 8) * 2
+        if len(self._irq_pool) != pool_buffers or len(self._irq_pool[0]) != buf_bytes:
+            self._irq_pool = []
+            gc.collect()
+            self._irq_pool = [bytearray(buf_bytes) for _ in range(pool_buffers)]
+
+        self._irq_generator = wave_generator
+        self._irq_frames = playback_frames
+        if attack_ms is None:
+            attack_ms = self.audio.get("attack_ms", 0)
+        if release_ms is None:
+            release_ms = self.audio.get("release_ms", 0)
+        self._start_envelope(volume if volume_left is None else volume_left,
+                             volume if volume_right is None else volume_right,
+                             attack_ms)
+        self._irq_release_frames = self._ms_to_frames(release_ms)
+        self._irq_next_segment = next_segment
+        self._irq_stop = None
+        self._irq_tail = -1
+        self.last_preempted = False
+        self.last_frames_played = None
+
+        # pre-fill every pool buffer before the first write
+        for buf in self._irq_pool:
+            self._fill_pool_buffer(buf)
+
+        # checked before unmuting, so a bad duration never leaves the output on
+        deadline = self._duration_ms(duration_seconds)
+
+        gc.collect()
+        self.last_start_error_us = None
+        if start_at_us is None:
+            self.enable_audio()
+        elif not self._wait_until(start_at_us, stop_check):
+            # stopped while waiting for the scheduled start
+            self.last_preempted = True
+            self.disable_audio()
+            self.last_stop_us = time.ticks_us()
+            return
+
+        self._irq_start_ms = time.ticks_ms()
+        self._irq_deadline = deadline
+
+        print(f"Starting IRQ audio output{' for '+str(duration_seconds)+'s' if duration_seconds else ''}...")
+        self.playing = True
+        self._irq_next = 1
+        self._irq_last_us = time.ticks_us()
+        self.i2s.irq(self._irq_cb)
+        self.i2s.write(self._irq_pool[0])
+
+    def _irq_callback(self, i2s):
+        """I2S IRQ handler: queue the next pool buffer, then refill the released one."""
+        if not self.playing:
+            return
+        pool = self._irq_pool
+        n = len(pool)
+
+        if self._irq_stop == "immediate":
+            self._finish_playback()
+            return
+
+        if self._irq_tail < 0:
+            self.apply_control()
+            if (not self._irq_stop and self._irq_deadline is not None and
+                    time.ticks_diff(time.ticks_ms(), self._irq_start_ms) >= self._irq_deadline and
+                    self._irq_next_segment is not None):
+                # segment done: splice in the next one, if any
+                segment = self._irq_next_segment()
+                if segment is not None:
+                    self._irq_generator, duration_seconds, vl, vr = segment
+                    self.set_volume(vl, vr, self.audio.get("volume_ramp_ms", 0))
+                    self._irq_start_ms = time.ticks_ms()
+                    self._irq_deadline = self._duration_ms(duration_seconds)
+            if self._irq_stop or (self._irq_deadline is not None and
+                                  time.ticks_diff(time.ticks_ms(), self._irq_start_ms) >= self._irq_deadline):
+                # release (or straight silence without one): ramp newly filled
+                # buffers down, then let the already-filled pool and the DMA
+                # buffer drain before muting
+                self._ramp_q15(0, 0, self._irq_release_frames)
+                self._irq_tail = (n - 1) + self._release_buffers(self._irq_release_frames, self._irq_frames)
+        elif self._irq_tail == 0:
+            self._finish_playback()
+            return
+        else:
+            self._irq_tail -= 1
+
+        idx = self._irq_next
+        i2s.write(pool[idx])
+        self._irq_next = (idx + 1) % n
+
+        # the buffer queued before this one has now been handed to DMA
+        ws = time.ticks_us()
+        try:
+            buf = pool[(idx - 1) % n]
+            self._fill_pool_buffer(buf)
+        except Exception as e:
+            print(f"Error during IRQ playback: {e}")
+            self._finish_playback()
+            return
+        we = time.ticks_us()
+        # dt is the refill time; gap is the interval between IRQs
+        dt = time.ticks_diff(we, ws)
+        gap = time.ticks_diff(ws, self._irq_last_us)
+        free = gc.mem_free()
+        self.trace.record(time.ticks_ms(), dt, gap, len(buf), free)
+        self.metrics.write(dt, gap, len(buf), len(buf), free)
+        self._irq_last_us = ws
+
+    def _finish_playback(self):
+        """Detach the IRQ handler, return I2S to blocking mode and mute the output."""
+        self.playing = False
+        self.i2s.irq(None)
+        self.disable_audio()
+        self.last_stop_us = time.ticks_us()
+
+    def stop_playback(self, immediate=False):
+        """
+        Request that IRQ playback ends at the next buffer boundary: through the
+        release ramp by default, or muted at once when immediate is True.
+        """
+        if self.playing:
+            self.last_preempted = True
+            self._irq_stop = "immediate" if immediate else "fade"
+
+    def wait_playback(self, poll_ms=10):
+        """Block until IRQ playback has finished."""
+        while self.playing:
+            time.sleep_ms(poll_ms)
+
+    def play_pipelined(self,
+                       wave_generator,
+                       playback_frames=None,
+                       duration_seconds=None,
+                       volume: float = 1.0,
+                       volume_left=None,
+                       volume_right=None,
+                       attack_ms=None,
+                       release_ms=None,
+                       stop_check=None,
+                       next_segment=None,
+                       start_at_us=None,
+                       volume_check=None):
+        """
+        Pipelined playback: a producer (audio_pipeline.Producer) reads and scales
+        into a lock-free ring of audio.pipeline_slots preallocated buffers and the
+        consumer does nothing but feed I2S, so storage and DSP jitter is absorbed by
+        the ring instead of reaching the output.
+
+        audio.pipeline_producer_core selects where the producer runs:
+          1: as an asyncio task on core 1 next to the network loop (main.py adds
+             self.producer.run() to the WiFi controller's tasks); this loop on
+             core 0 feeds I2S with blocking writes.
+          0: stepped from this loop on core 0, while the I2S IRQ handler consumes
+             the ring with non-blocking writes.
+        Arguments are as in play_audio; durations are counted in frames (the
+        producer cuts a segment's last buffer to its remaining frames). Volume
+        changes are handed to the producer (the only writer of the gain block
+        while it runs); a fade stop also ramps the buffers already in the ring.
+        """
+        if attack_ms is None:
+            attack_ms = self.audio.get("attack_ms", 0)
+        if release_ms is None:
+            release_ms = self.audio.get("release_ms", 0)
+        if playback_frames is None:
+            playback_frames = self.audio.get(
+                "playback_frames",
+                self.audio["buffer_length"]
+            )
+        if self.playing:
+            raise RuntimeError("Playback already in progress")
+        if self.i2s is None:
+            self.initialize_i2s()
+
+        frame_bytes = (self.audio['bits_per_sample'] // 8) * 2
+        producer_core = self.audio.get("pipeline_producer_core", 1)
+        slots = self.audio.get("pipeline_slots", 4)
+        producer = self.producer
+        ring = producer.prepare(slots, playback_frames, frame_bytes)
+        if self._silence is None:
+            self._silence = bytearray(4096)
+
+        self._start_envelope(volume if volume_left is None else volume_left,
+                             volume if volume_right is None else volume_right,
+                             attack_ms)
+        self.last_preempted = False
+        self.last_start_error_us = None
+        self.last_frames_played = None
+        release_frames = self._ms_to_frames(release_ms)
+        producer.start(wave_generator, playback_frames, duration_seconds,
+                       release_frames, next_segment)
+
+        # pre-fill: let the producer fill the ring before output starts
+        if producer_core == 0:
+            producer.step()
+        else:
+            started = time.ticks_ms()
+            while ring.occupancy() < slots and not producer.done:
+                if time.ticks_diff(time.ticks_ms(), started) > 1000:
+                    producer.request_stop("immediate")
+                    raise RuntimeError("Audio producer is not running on core 1")
+                time.sleep_ms(1)
+
+        gc.collect()
+
+        # scheduled start: wait muted, then pad with silence up to the target time
+        if start_at_us is None:
+            self.enable_audio()
+        elif not self._wait_until(start_at_us, stop_check):
+            self.last_preempted = True
+            producer.request_stop("immediate")
+            self.disable_audio()
+            self.last_stop_us = time.ticks_us()
+            return
+
+        trace = self.trace
+        metrics = self.metrics
+        stop = None
+
+        print(f"Starting pipelined audio output{' for '+str(duration_seconds)+'s' if duration_seconds else ''}...")
+        try:
+            if producer_core == 0:
+                # consumer: the I2S IRQ; this loop produces and services requests
+                self._pipeline_inflight = False
+                self._pipeline_fade = -1
+                self.playing = True
+                self._irq_last_us = time.ticks_us()
+                self.i2s.irq(self._pipeline_cb)
+                self._pipeline_irq(self.i2s)
+                while self.playing:
+                    if stop_check is not None and not stop:
+                        stop = stop_check()
+                        if stop:
+                            self.last_preempted = True
+                            producer.request_stop(stop)
+                            if stop == "immediate":
+                                self._finish_playback()
+                                break
+                            # the IRQ ramps the queued buffers down, then mutes
+                            self._start_fade(release_frames)
+                            self._pipeline_fade = self._release_buffers(release_frames, playback_frames)
+                    if volume_check is not None:
+                        change = volume_check()
+                        if change is not None:
+                            producer.request_volume(*change)
+                    producer.step()
+                    time.sleep_ms(1)
+            else:
+                # consumer: this loop only moves ring buffers into I2S
+                last_loop = time.ticks_us()
+                starved = False
+                fade = -1  # buffers left to write after a fade stop
+                while True:
+                    if stop_check is not None and not stop:
+                        stop = stop_check()
+                        if stop:
+                            self.last_preempted = True
+                            producer.request_stop(stop)
+                            if stop == "immediate":
+                                break
+                            # ramp the buffers already in the ring, then flush and mute
+                            self._start_fade(release_frames)
+                            fade = self._release_buffers(release_frames, playback_frames)
+                    if volume_check is not None:
+                        change = volume_check()
+                        if change is not None:
+                            producer.request_volume(*change)
+
+                    mv = ring.consumer_view()
+                    if mv is None:
+                        if producer.done:
+                            break
+                        # the producer fell behind: count the episode once
+                        if not starved:
+                            ring.underrun()
+                            starved = True
+                        time.sleep_us(200)
+                        continue
+                    starved = False
+                    if fade > 0:
+                        _viper_scale_stereo(mv, mv, len(mv) // 4, self._fade)
+
+                    ws = time.ticks_us()
+                    written = self.i2s.write(mv)
+                    we = time.ticks_us()
+                    ring.release()
+                    free = gc.mem_free()
+                    dt = time.ticks_diff(we, ws)
+                    gap = time.ticks_diff(we, last_loop)
+                    trace.record(time.ticks_ms(), dt, gap, written, free)
+                    metrics.write(dt, gap, written, len(mv), free)
+                    last_loop = we
+                    if fade > 0:
+                        fade -= 1
+                        if fade == 0:
+                            break
+
+        except KeyboardInterrupt:
+            print("Audio playback interrupted by user")
+        except Exception as e:
+            print(f"Error during pipelined playback: {e}")
+        finally:
+            if producer_core == 0:
+                if self.playing:
+                    self._finish_playback()
+            else:
+                self.disable_audio()
+                self.last_stop_us = time.ticks_us()
+            # make sure the producer has let go of the ring before it is reused
+            if not producer.done:
+                producer.request_stop("immediate")
+                if producer_core == 0:
+                    producer.step()
+                started = time.ticks_ms()
+                while not producer.done and time.ticks_diff(time.ticks_ms(), started) < 100:
+                    time.sleep_ms(1)
+
+    def _pipeline_irq(self, i2s):
+        """I2S IRQ consumer for pipelined playback: release the slot played out, queue the next"""
+        if not self.playing:
+            return
+        ring = self.producer.ring
+        if self._pipeline_inflight:
+            ring.release()
+        mv = ring.consumer_view()
+        if mv is None:
+            self._pipeline_inflight = False
+            if self.producer.done:
+                self._finish_playback()
+                return
+            # the producer fell behind: keep the IRQ chain alive with silence
+            ring.underrun()
+            i2s.write(self._silence)
+            return
+        if self._pipeline_fade == 0:
+            # fade stop: the ramp and DMA flush have been queued
+            self._finish_playback()
+            return
+        if self._pipeline_fade > 0:
+            _viper_scale_stereo(mv, mv, len(mv) // 4, self._fade)
+            self._pipeline_fade -= 1
+        self._pipeline_inflight = True
+        ws = time.ticks_us()
+        i2s.write(mv)
+        we = time.ticks_us()
+        dt = time.ticks_diff(we, ws)
+        gap = time.ticks_diff(ws, self._irq_last_us)
+        free = gc.mem_free()
+        self.trace.record(time.ticks_ms(), dt, gap, len(mv), free)
+        self.metrics.write(dt, gap, len(mv), len(mv), free)
+        self._irq_last_us = ws
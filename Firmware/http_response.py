@@ -0,0 +1,154 @@
+import json
+
+# status lines and headers, built once
+_STATUS = {
+    200: b"HTTP/1.1 200 OK\r\n",
+    400: b"HTTP/1.1 400 Bad Request\r\n",
+    405: b"HTTP/1.1 405 Method Not Allowed\r\n",
+    408: b"HTTP/1.1 408 Request Timeout\r\n",
+    409: b"HTTP/1.1 409 Conflict\r\n",
+    411: b"HTTP/1.1 411 Length Required\r\n",
+    413: b"HTTP/1.1 413 Payload Too Large\r\n",
+    500: b"HTTP/1.1 500 Internal Server Error\r\n",
+    501: b"HTTP/1.1 501 Not Implemented\r\n",
+    503: b"HTTP/1.1 503 Service Unavailable\r\n",
+    507: b"HTTP/1.1 507 Insufficient Storage\r\n",
+}
+_CONTENT = b"Content-Type: application/json\r\nContent-Length: "
+_KEEP_ALIVE = b"\r\nConnection: keep-alive\r\n\r\n"
+_CLOSE = b"\r\nConnection: close\r\n\r\n"
+# room in front of the body for the longest status line + headers
+_HEAD_ROOM = 128
+
+_NULL = b"null"
+_TRUE = b"true"
+_FALSE = b"false"
+
+
+class ResponseWriter:
+    """
+    Renders JSON responses straight into one reusable buffer.
+
+    The body is serialized value by value into the buffer (integers digit by
+    digit, strings copied as UTF-8, structure from static byte tokens), then
+    the status line and headers are copied from prebuilt templates into the
+    space reserved in front of it, with the Content-Length filled in. The
+    whole response goes out as a single write() of a slice of the buffer, so
+    no json.dumps() text and no concatenated response string is built.
+
+    The buffer grows (and stays grown) if a response doesn't fit. It is only
+    valid until the next render(); stream write() copies whatever it can't
+    send at once, so one writer can be shared by every connection of the
+    asyncio server.
+    """
+    def __init__(self, size=2048):
+        self.buf = bytearray(_HEAD_ROOM + size)
+        self.n = 0
+
+    def _reserve(self, k):
+        if self.n + k > len(self.buf):
+            self.buf.extend(bytes(max(k, len(self.buf))))
+
+    def _raw(self, b):
+        k = len(b)
+        self._reserve(k)
+        self.buf[self.n:self.n + k] = b
+        self.n += k
+
+    def _byte(self, c):
+        self._reserve(1)
+        self.buf[self.n] = c
+        self.n += 1
+
+    def _int(self, v):
+        if v < 0:
+            self._byte(0x2D)  # '-'
+            v = -v
+        digits = 1
+        t = v
+        while t >= 10:
+            t //= 10
+            digits += 1
+        self._reserve(digits)
+        self.n += digits
+        i = self.n
+        while digits:
+            i -= 1
+            self.buf[i] = 0x30 + v % 10
+            v //= 10
+            digits -= 1
+
+    def _str(self, s):
+        b = s.encode('utf-8')
+        for c in b:
+            if c < 0x20 or c == 0x22 or c == 0x5C:
+                # rare: quotes, backslashes or control characters need escaping
+                self._raw(json.dumps(s).encode('utf-8'))
+                return
+        self._byte(0x22)
+        self._raw(b)
+        self._byte(0x22)
+
+    def value(self, v):
+        """Append one JSON value (dict, list/tuple, str, int, float, bool or None)"""
+        if v is None:
+            self._raw(_NULL)
+        elif v is True:
+            self._raw(_TRUE)
+        elif v is False:
+            self._raw(_FALSE)
+        elif isinstance(v, int):
+            self._int(v)
+        elif isinstance(v, float):
+            self._raw(str(v).encode('utf-8'))
+        elif isinstance(v, str):
+            self._str(v)
+        elif isinstance(v, dict):
+            self._byte(0x7B)  # '{'
+            first = True
+            for key, item in v.items():
+                if not first:
+                    self._byte(0x2C)  # ','
+                first = False
+                self._str(key if isinstance(key, str) else str(key))
+                self._byte(0x3A)  # ':'
+                self.value(item)
+            self._byte(0x7D)  # '}'
+        elif isinstance(v, (list, tuple)):
+            self._byte(0x5B)  # '['
+            first = True
+            for item in v:
+                if not first:
+                    self._byte(0x2C)
+                first = False
+                self.value(item)
+            self._byte(0x5D)  # ']'
+        else:
+            self._str(str(v))
+
+    def render(self, status, payload=None, keep_alive=True):
+        """
+        Render a complete response (status code, JSON payload or None for an
+        empty body) and return it as a memoryview into the buffer.
+        """
+        self.n = _HEAD_ROOM
+        if payload is not None:
+            self.value(payload)
+        end = self.n
+        length = end - _HEAD_ROOM
+
+        status_line = _STATUS.get(status, _STATUS[500])
+        connection = _KEEP_ALIVE if keep_alive else _CLOSE
+        digits = 1
+        t = length
+        while t >= 10:
+            t //= 10
+            digits += 1
+        start = _HEAD_ROOM - len(status_line) - len(_CONTENT) - digits - len(connection)
+        self.n = start
+        self._raw(status_line)
+        self._raw(_CONTENT)
+        self._int(length)
+        self._raw(connection)
+        self.n = end
+        return memoryview(self.buf)[start:end]
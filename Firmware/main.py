@@ -1,7 +1,13 @@
 import time
 import json
+import os
 from hardware_controller import HardwareController
-from wav_file_player import RawFilePlayer
+from wav_file_player import RawFilePlayer, WavFilePlayer
+from adpcm_file_player import AdpcmFilePlayer
+from noise_generator import NoiseGenerator
+from tone_generator import ToneGenerator
+from mixer_generator import MixerGenerator
+from stimulus_library import StimulusLibrary, stimulus_kind
 import _thread 
 from network_controller import WiFiController
 
@@ -14,39 +20,188 @@ def load_config():
         print("Error loading config.json. Using default settings.", e)
         return {}
 
+def save_config(config):
+    """Write config back to config.json (via a temporary file, so a reset mid-write keeps the old one)."""
+    try:
+        with open('config.json.tmp', 'w') as f:
+            json.dump(config, f)
+        os.rename('config.json.tmp', 'config.json')
+    except Exception as e:
+        print("Error saving config.json:", e)
+
+def open_player(filename, config, loop=None):
+    """
+    Open a stimulus file with the player matching its extension (.wav, .adpcm or .raw PCM).
+    'loop' is an optional (start_frame, end_frame) loop region (PCM players only;
+    ADPCM files always loop whole). Other files raise ValueError rather than
+    being played as raw PCM.
+    """
+    kind = stimulus_kind(filename)
+    if kind is None:
+        raise ValueError(f"Cannot open {filename}: not a .wav, .adpcm or .raw file")
+    try:
+        if kind == 'wav':
+            return WavFilePlayer(filename, config, loop=loop)
+        if kind == 'adpcm':
+            return AdpcmFilePlayer(filename, config)
+        return RawFilePlayer(filename, config, loop=loop)
+    except OSError as e:
+        raise ValueError(f"Cannot open {filename}: {e}")
+
+class PlayerCache:
+    """
+    Players for per-request files, opened on first use and kept open for reuse.
+    Players are keyed on (filename, loop) and rewound on every get, so each
+    request plays its stimulus from the start with its own loop region.
+    At most 'size' (>= 2) stay open; the least recently used is closed first,
+    which is never the one playing when a new segment is spliced in.
+    """
+    def __init__(self, config, default_player, size=4):
+        self.config = config
+        self.default_player = default_player
+        self.size = max(size, 2)
+        self.players = {}
+        self.order = []
+
+    def get(self, filename, loop=None):
+        if filename is None:
+            self.default_player.rewind()
+            return self.default_player
+        key = (filename, tuple(loop) if loop is not None else None)
+        player = self.players.get(key)
+        if player is None:
+            player = open_player(filename, self.config, loop)
+            if len(self.order) >= self.size:
+                oldest = self.order.pop(0)
+                self.players.pop(oldest).close()
+            self.players[key] = player
+        else:
+            self.order.remove(key)
+            player.rewind()
+        self.order.append(key)
+        return player
+
+    def drop(self, filename):
+        """Close the cached players for 'filename' (e.g. the file was replaced by an upload)"""
+        for key in [key for key in self.order if key[0] == filename]:
+            self.order.remove(key)
+            self.players.pop(key).close()
+
+def select_source(play_request, files, noise, tone, mixer):
+    """Pick the wave generator for a play request, applying per-request parameters."""
+    source = play_request.get('source')
+    file_player = files.get(play_request.get('file'), play_request.get('loop')) if source not in ('noise', 'tone') else None
+    mix = play_request.get('mix') if source == 'mix' else None
+    uses = (mix['left'], mix['right']) if mix else (source,)
+    if 'noise' in uses:
+        # the band is set per request (make_play_request fills in the config defaults)
+        noise.set_band(play_request['min_frequency'], play_request['max_frequency'])
+    if 'tone' in uses and play_request.get('tones'):
+        tone.set_tones(play_request['tones'])
+    if mix:
+        # two mono sources: one per output channel, each with its own gain
+        sources = {'file': file_player, 'noise': noise, 'tone': tone}
+        mixer.set_sources(sources[mix['left']], sources[mix['right']],
+                          mix['left_gain'], mix['right_gain'])
+        return mixer
+    if source == 'noise':
+        return noise
+    if source == 'tone':
+        return tone
+    return file_player
+
 def main():
     # Load configuration settings
     config = load_config()
 
-    # Initialize WiFi controller and start it on the second core
+    # Initialize the WiFi and hardware controllers
     wifi = WiFiController(config)
+    hw = HardwareController(config)
+    wifi.trace = hw.trace  # served by the /trace endpoint
+    wifi.metrics = hw.metrics  # served by the /metrics endpoint
+    wifi.pipeline = hw.producer  # ring occupancy in /metrics
+    wifi.control = hw.control  # live volume/balance/gain from /control and /gain
+
+    # Index the stimulus library once, before requests can refer to it by name
+    library = StimulusLibrary(config)
+    library.scan()
+    wifi.library = library  # /play?name=... and /library
+
+    # Pipelined playback: the producer shares the second core with the network loop
+    audio_cfg = config.get("audio", {})
+    if audio_cfg.get("playback_mode") == "pipeline" and audio_cfg.get("pipeline_producer_core", 1) == 1:
+        wifi.tasks.append(hw.producer.run())
+
+    # Start the WiFi controller on the second core
     wifi.start()
 
-    # Initialize the hardware controller and blink the LED
-    hw = HardwareController(config)
     hw.blink_led(5) # Blink LED 5 times to indicate startup
     time.sleep(0.5)
 
     # Initialize I2S hardware
     hw.initialize_i2s()
 
-    # Create the raw PCM file player
-    file_player = RawFilePlayer("my_sound.raw", config)
+    # Create the default stimulus file player (raw PCM, WAV, or IMA-ADPCM for *.adpcm);
+    # requests may name another file, opened on demand
+    file_player = open_player(config.get("audio", {}).get("file", "my_sound.raw"), config)
+    files = PlayerCache(config, file_player, config.get("audio", {}).get("max_open_files", 4))
+
+    # On-device noise synthesizer (no flash I/O)
+    noise = NoiseGenerator(config)
 
-    #
+    # On-device sine / multi-tone synthesizer (frequency/amplitude from config["audio"])
+    tone = ToneGenerator(config)
+
+    # Two-source stereo mixer (e.g. texture file left, noise right)
+    mixer = MixerGenerator(config)
 
     # Determine playback frames from config (fallback to buffer_length)
     adjusted_frames = config.get("audio", {}).get("playback_frames",
                             config.get("audio", {}).get("buffer_length", 1024))
     print(f"\nUsing playback_frames = {adjusted_frames}")
 
+    # "blocking" writes from this loop; "irq" refills from the I2S IRQ so the loop stays free;
+    # "pipeline" decouples producing (read + scale) from feeding I2S through an SPSC ring
+    playback_mode = config.get("audio", {}).get("playback_mode", "blocking")
+    print(f"Using playback_mode = {playback_mode}")
+
+    def next_segment():
+        """Pop the next queued segment for gapless playback, skipping invalid ones"""
+        while True:
+            segment = wifi.check_play_request()
+            if segment is None:
+                return None
+            try:
+                source = select_source(segment, files, noise, tone, mixer)
+            except Exception as e:
+                print(f"Skipping invalid segment: {e}")
+                continue
+            print(f"Next segment: source={segment['source']}, duration={segment['duration']}s")
+            return (source, segment['duration'], segment['volume_left'], segment['volume_right'])
+
     # Main loop - check for requests from the WiFi controller
     while True:
-        # Check for gain change requests
-        gain_level = wifi.check_gain_request()
-        if gain_level is not None:
-            print(f"Setting amplifier gain to level {gain_level}")
-            hw.set_gain(gain_level)
+        # Live control changes (amp gain) while idle; during playback the audio loop applies them
+        hw.apply_control()
+            
+        # Uploaded files replace the old ones on flash; reopen them on next use
+        replaced = wifi.check_replaced_files()
+        if replaced:
+            for path in replaced:
+                files.drop(path)
+            
+        # Buffer calibration: measure, keep the smallest underrun-free setup, persist it
+        if wifi.check_calibrate_request():
+            print("Calibrating playback buffers...")
+            try:
+                result = hw.calibrate(file_player)
+                adjusted_frames = result['playback_frames']
+                save_config(config)
+                print(f"Calibrated: playback_frames={adjusted_frames}, dma_buffer_frames={result['dma_buffer_frames']}")
+            except Exception as e:
+                result = {'ok': False, 'error': str(e)}
+                print(f"Calibration failed: {e}")
+            wifi.calibration_finished(result)
             
         # Check for play requests
         play_request = wifi.check_play_request()
@@ -54,25 +209,77 @@ def main():
             # We have a play request - start audio playback
             duration = play_request['duration']
             volume = play_request['volume']
+            volume_left = play_request.get('volume_left', volume)
+            volume_right = play_request.get('volume_right', volume)
             
-            print(f"Playing audio: duration={duration}s, volume={volume}")
+            print(f"Playing audio: duration={duration}s, volume L={volume_left} R={volume_right}")
             
             try:
-                hw.play_audio(
-                    wave_generator=file_player,
-                    playback_frames=adjusted_frames,
-                    aggregate_count=1,
-                    debug=True,
-                    duration_seconds=duration,
-                    volume=volume
-                )
+                source = select_source(play_request, files, noise, tone, mixer)
+
+                if playback_mode == "irq":
+                    hw.start_playback(
+                        wave_generator=source,
+                        playback_frames=adjusted_frames,
+                        duration_seconds=duration,
+                        volume_left=volume_left,
+                        volume_right=volume_right,
+                        next_segment=next_segment,
+                        start_at_us=play_request.get('at'),
+                        stop_check=wifi.check_stop_request
+                    )
+                    # Service stop and volume requests while the IRQ streams audio
+                    while hw.playing:
+                        stop = wifi.check_stop_request()
+                        if stop:
+                            hw.stop_playback(immediate=(stop == "immediate"))
+                        change = wifi.check_volume_request()
+                        if change is not None:
+                            hw.set_volume(*change)
+                        time.sleep_ms(1)
+                elif playback_mode == "pipeline":
+                    hw.play_pipelined(
+                        wave_generator=source,
+                        playback_frames=adjusted_frames,
+                        duration_seconds=duration,
+                        volume_left=volume_left,
+                        volume_right=volume_right,
+                        stop_check=wifi.check_stop_request,
+                        volume_check=wifi.check_volume_request,
+                        next_segment=next_segment,
+                        start_at_us=play_request.get('at')
+                    )
+                else:
+                    hw.play_audio(
+                        wave_generator=source,
+                        playback_frames=adjusted_frames,
+                        aggregate_count=1,
+                        debug=config.get("audio", {}).get("debug", False),
+                        duration_seconds=duration,
+                        volume_left=volume_left,
+                        volume_right=volume_right,
+                        stop_check=wifi.check_stop_request,
+                        volume_check=wifi.check_volume_request,
+                        next_segment=next_segment,
+                        start_at_us=play_request.get('at')
+                    )
+            except ValueError as e:
+                print(f"Invalid play request: {e}")
+            except Exception as e:
+                # Keep the audio loop alive whatever a request did
+                print(f"Playback failed: {e}")
             finally:
-                # Mark playback as complete
-                with wifi.play_request_lock:
-                    wifi.audio_playing = False
+                # Mark playback as complete and report when the output stopped
+                wifi.playback_finished(hw.last_stop_us, hw.last_frames_played)
+                if hw.last_preempted:
+                    print(f"Playback stopped on request at ticks_us={hw.last_stop_us}")
+                if hw.last_frames_played is not None:
+                    print(f"Delivered {hw.last_frames_played} frames")
+                if hw.last_start_error_us:
+                    print(f"Scheduled start was {hw.last_start_error_us} us late")
                     
-                    # Give other tasks a chance to run
-                    time.sleep_ms(100)
+                # Give other tasks a chance to run
+                time.sleep_ms(100)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,112 @@
+from array import array
+
+# inter-write gap histogram: upper bucket edges in microseconds (last bucket is open)
+GAP_EDGES_US = (5000, 10000, 20000, 30000, 50000, 100000)
+
+# endpoints with their own latency counters; anything else is counted as 'other'
+ENDPOINTS = ('/play', '/playlist', '/stop', '/gain', '/led', '/status', '/trace', '/metrics', '/calibrate', '/library', '/files', '/control', 'other')
+
+# write counter layout (see Metrics.writes)
+_W_COUNT = 0
+_W_INCOMPLETE = 1
+_W_MAX_US = 2
+_W_SUM_US = 3
+_W_SUM_N = 4
+_W_GC_RUNS = 5
+_W_MIN_FREE = 6
+_W_LAST_FREE = 7
+
+# per-endpoint layout: count, max_us, sum_us, sum_n
+_R_FIELDS = 4
+
+
+class Metrics:
+    """
+    Health counters for playback and request handling, kept in preallocated
+    integer arrays so updating them from the audio loop (or the I2S IRQ) never
+    allocates. snapshot() builds the /metrics report on demand.
+
+    Averages keep a running sum and count; both are halved before the sum can
+    leave the small-int range, which preserves the average.
+
+    GC runs are inferred from the free heap: MicroPython only reclaims memory by
+    collecting, so a rise in gc.mem_free() between samples means a collection ran
+    (including automatic ones and those on the other core).
+    """
+    def __init__(self, gap_edges_us=GAP_EDGES_US):
+        self.gap_edges_us = array('i', gap_edges_us)
+        self.gaps = array('i', [0] * (len(gap_edges_us) + 1))
+        self.writes = array('i', [0, 0, 0, 0, 0, 0, 0x3FFFFFFF, 0])
+        self.requests = array('i', [0] * (len(ENDPOINTS) * _R_FIELDS))
+
+    def heap(self, free):
+        """Sample the free heap: tracks the minimum and counts collections"""
+        w = self.writes
+        if free < w[_W_MIN_FREE]:
+            w[_W_MIN_FREE] = free
+        if free > w[_W_LAST_FREE] and w[_W_LAST_FREE]:
+            w[_W_GC_RUNS] += 1
+        w[_W_LAST_FREE] = free
+
+    def write(self, dt_us, gap_us, written, expected, free):
+        """Account one I2S write"""
+        w = self.writes
+        w[_W_COUNT] += 1
+        if written < expected:
+            w[_W_INCOMPLETE] += 1
+        if dt_us > w[_W_MAX_US]:
+            w[_W_MAX_US] = dt_us
+        if w[_W_SUM_US] > 0x1FFFFFFF:
+            w[_W_SUM_US] >>= 1
+            w[_W_SUM_N] >>= 1
+        w[_W_SUM_US] += dt_us
+        w[_W_SUM_N] += 1
+        edges = self.gap_edges_us
+        b = 0
+        n = len(edges)
+        while b < n and gap_us >= edges[b]:
+            b += 1
+        self.gaps[b] += 1
+        self.heap(free)
+
+    def request(self, path, dt_us):
+        """Account one handled HTTP request"""
+        i = ENDPOINTS.index(path) if path in ENDPOINTS else len(ENDPOINTS) - 1
+        r = self.requests
+        i *= _R_FIELDS
+        r[i] += 1
+        if dt_us > r[i + 1]:
+            r[i + 1] = dt_us
+        if r[i + 2] > 0x1FFFFFFF:
+            r[i + 2] >>= 1
+            r[i + 3] >>= 1
+        r[i + 2] += dt_us
+        r[i + 3] += 1
+
+    def snapshot(self):
+        """Return the counters as a JSON-ready dict"""
+        w = self.writes
+        edges = self.gap_edges_us
+        gaps = {}
+        for b in range(len(self.gaps)):
+            gaps[f"lt_{edges[b]}" if b < len(edges) else f"ge_{edges[-1]}"] = self.gaps[b]
+        requests = {}
+        r = self.requests
+        for k, path in enumerate(ENDPOINTS):
+            i = k * _R_FIELDS
+            if r[i]:
+                requests[path] = {
+                    'count': r[i],
+                    'max_us': r[i + 1],
+                    'avg_us': r[i + 2] // r[i + 3] if r[i + 3] else 0
+                }
+        return {
+            'writes': w[_W_COUNT],
+            'incomplete_writes': w[_W_INCOMPLETE],
+            'write_max_us': w[_W_MAX_US],
+            'write_avg_us': w[_W_SUM_US] // w[_W_SUM_N] if w[_W_SUM_N] else 0,
+            'gap_us': gaps,
+            'gc_runs': w[_W_GC_RUNS],
+            'min_free': w[_W_MIN_FREE] if w[_W_LAST_FREE] else None,
+            'requests': requests
+        }
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Pico 2W Clock Sync
+------------------
+Estimates the mapping from host time to the device's time.ticks_us() clock over the
+firmware's UDP clock-sync port, and can schedule a playback at a precise host time
+with /play?at=<device_ticks_us>.
+"""
+
+import argparse
+import socket
+import struct
+import time
+
+import requests
+
+# time.ticks_us() on the device wraps at 2**30 microseconds
+TICKS_PERIOD = 1 << 30
+
+
+class ClockSync:
+    def __init__(self, ip, port=5005, timeout=0.5):
+        self.ip = ip
+        self.port = port
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+        self.host_ref_us = None
+        self.device_ref_us = None
+        self.best_rtt_us = None
+
+    def exchange(self):
+        """One request/reply; returns (rtt_us, host_us, device_us) for the reply instant"""
+        t0 = time.perf_counter_ns() // 1000
+        self.sock.sendto(struct.pack('<q', t0), (self.ip, self.port))
+        data, _ = self.sock.recvfrom(64)
+        t3 = time.perf_counter_ns() // 1000
+        echo, t1, t2 = struct.unpack('<8sII', data[:16])
+        if struct.unpack('<q', echo)[0] != t0:
+            raise ValueError("Stale sync reply")
+        device_busy = (t2 - t1) % TICKS_PERIOD
+        rtt = (t3 - t0) - device_busy
+        # assume symmetric paths: the device read t2 half a round trip before t3
+        return rtt, t3, (t2 + rtt // 2) % TICKS_PERIOD
+
+    def sync(self, count=32):
+        """Keep the exchange with the smallest round trip out of 'count' tries"""
+        for _ in range(count):
+            try:
+                rtt, host_us, device_us = self.exchange()
+            except (socket.timeout, ValueError):
+                continue
+            if self.best_rtt_us is None or rtt < self.best_rtt_us:
+                self.best_rtt_us = rtt
+                self.host_ref_us = host_us
+                self.device_ref_us = device_us
+            time.sleep(0.005)
+        if self.best_rtt_us is None:
+            raise RuntimeError("No clock sync replies from device")
+        return self.best_rtt_us
+
+    def host_now_us(self):
+        return time.perf_counter_ns() // 1000
+
+    def device_ticks_at(self, host_us):
+        """Device ticks_us corresponding to a host perf_counter time in microseconds"""
+        return (self.device_ref_us + (host_us - self.host_ref_us)) % TICKS_PERIOD
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sync with a Pico 2W and schedule playback')
+    parser.add_argument('--ip', type=str, default='192.168.86.215',
+                        help='IP address of the Pico 2W (default: 192.168.86.215)')
+    parser.add_argument('--port', type=int, default=5005, help='UDP clock-sync port (default: 5005)')
+    parser.add_argument('--delay', type=float, default=0.5,
+                        help='Schedule a playback this many seconds from now (default: 0.5)')
+    parser.add_argument('--duration', type=float, default=1.0, help='Playback duration in seconds')
+    parser.add_argument('--volume', type=float, default=0.3, help='Playback volume 0.0..1.0')
+    args = parser.parse_args()
+
+    clock = ClockSync(args.ip, args.port)
+    rtt = clock.sync()
+    print(f"Best round trip: {rtt} us (offset uncertainty <= {rtt // 2} us)")
+
+    start_host_us = clock.host_now_us() + int(args.delay * 1e6)
+    at = clock.device_ticks_at(start_host_us)
+    response = requests.get(
+        f"http://{args.ip}/play?duration={args.duration}&volume={args.volume}&at={at}", timeout=5)
+    print(f"Status Code: {response.status_code}")
+    print(f"Response: {response.json()}")
+    print(f"Playback scheduled at device ticks_us={at} (host perf_counter_us={start_host_us})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Host stand-in for MicroPython's 'machine' module: Pin and an I2S transmitter.
+
+I2S keeps a FIFO of 'ibuf' bytes that a clock thread drains at the sample
+rate times I2S.speed, the way the DMA drains the real buffer:
+  - blocking write() returns once all of its data fits in the FIFO;
+  - after irq(handler), write() returns at once and the handler is called
+    (from the clock thread) when that buffer has been moved into the FIFO.
+Everything the clock consumes is appended to the WAV file I2S.sink (if set).
+When the FIFO runs dry while audio is flowing and data arrives again within
+I2S.max_gap_s, the dry spell is counted as an underrun and written to the sink
+as silence, as the DAC would play it; longer gaps count as idle and are not
+recorded. Counters: frames_played, underruns, underrun_frames.
+"""
+import threading
+import time
+import wave
+
+
+class Pin:
+    IN = 0
+    OUT = 1
+    OPEN_DRAIN = 2
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    # Set to a callable(pin_id, value) to watch output changes (e.g. mute/amp pins)
+    on_change = None
+
+    def __init__(self, id, mode=-1, pull=-1, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = 0
+        if value is not None:
+            self.value(value)
+
+    def init(self, mode=-1, pull=-1, value=None):
+        self.mode = mode
+        if value is not None:
+            self.value(value)
+
+    def value(self, v=None):
+        if v is None:
+            return self._value
+        v = 1 if v else 0
+        if v != self._value and Pin.on_change is not None:
+            Pin.on_change(self.id, v)
+        self._value = v
+
+    def on(self):
+        self.value(1)
+
+    def off(self):
+        self.value(0)
+
+    def toggle(self):
+        self.value(not self._value)
+
+    def irq(self, handler=None, trigger=None):
+        pass
+
+    def __call__(self, v=None):
+        return self.value(v)
+
+    def __repr__(self):
+        return f"Pin({self.id!r})"
+
+
+class I2S:
+    RX = 0
+    TX = 1
+    MONO = 0
+    STEREO = 1
+
+    # host settings, set before the firmware creates its I2S object
+    sink = None        # WAV path receiving the consumed samples
+    speed = 1.0        # consume rate as a multiple of the sample rate
+    max_gap_s = 0.5    # longer dry spells are idle time, not underruns
+    tick_s = 0.002     # clock thread period
+    instances = []
+
+    def __init__(self, id, *, sck=None, ws=None, sd=None, mck=None, mode=TX, bits=16,
+                 format=STEREO, rate=44100, ibuf=8192):
+        self.id = id
+        self.bits = bits
+        self.rate = rate
+        self.frame_bytes = (bits // 8) * (2 if format == I2S.STEREO else 1)
+        self.ibuf = ibuf
+        self.frames_played = 0
+        self.underruns = 0
+        self.underrun_frames = 0
+        self._fifo = bytearray()
+        self._pending = []       # non-blocking writes not yet moved into the FIFO
+        self._handler = None
+        self._flowing = False    # samples were consumed on the last tick
+        self._dry_frames = 0
+        self._cond = threading.Condition()
+        self._wav = None
+        if I2S.sink:
+            self._wav = wave.open(I2S.sink, 'wb')
+            self._wav.setnchannels(2 if format == I2S.STEREO else 1)
+            self._wav.setsampwidth(bits // 8)
+            self._wav.setframerate(rate)
+        self._running = True
+        self._thread = threading.Thread(target=self._clock, daemon=True)
+        self._thread.start()
+        I2S.instances.append(self)
+
+    def write(self, buf):
+        data = bytes(buf)
+        with self._cond:
+            if self._handler is not None:
+                self._pending.append(data)
+                self._cond.notify_all()
+                return len(data)
+            pos = 0
+            while pos < len(data):
+                room = self.ibuf - len(self._fifo)
+                if room <= 0 or self._pending:
+                    self._cond.wait()
+                    continue
+                self._fifo += data[pos:pos + room]
+                pos += room
+        return len(data)
+
+    def irq(self, handler):
+        with self._cond:
+            self._handler = handler
+
+    def deinit(self):
+        self._running = False
+        self._thread.join()
+        with self._cond:
+            if self._wav is not None:
+                self._wav.close()
+                self._wav = None
+        if self in I2S.instances:
+            I2S.instances.remove(self)
+
+    def _clock(self):
+        due = 0.0
+        last = time.monotonic()
+        while self._running:
+            time.sleep(I2S.tick_s)
+            now = time.monotonic()
+            due += (now - last) * self.rate * I2S.speed
+            last = now
+            frames = int(due)
+            due -= frames
+            done = []
+            with self._cond:
+                # move queued non-blocking writes into the FIFO as room allows
+                while self._pending and len(self._fifo) < self.ibuf:
+                    data = self._pending[0]
+                    room = self.ibuf - len(self._fifo)
+                    self._fifo += data[:room]
+                    if len(data) <= room:
+                        self._pending.pop(0)
+                        done.append(data)
+                    else:
+                        self._pending[0] = data[room:]
+                out = bytes(self._fifo[:frames * self.frame_bytes])
+                del self._fifo[:len(out)]
+                played = len(out) // self.frame_bytes
+                if played and self._dry_frames:
+                    if self._dry_frames <= self.rate * I2S.max_gap_s:
+                        self.underruns += 1
+                        self.underrun_frames += self._dry_frames
+                        if self._wav is not None:
+                            self._wav.writeframes(bytes(self._dry_frames * self.frame_bytes))
+                    self._dry_frames = 0
+                if played < frames and (self._flowing or self._dry_frames):
+                    self._dry_frames += frames - played
+                self._flowing = played == frames
+                self.frames_played += played
+                if out and self._wav is not None:
+                    self._wav.writeframes(out)
+                self._cond.notify_all()
+                handler = self._handler
+            # like the IRQ: one call per buffer taken over from write()
+            if handler is not None:
+                for _ in done:
+                    handler(self)
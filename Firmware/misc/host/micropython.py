@@ -0,0 +1,121 @@
+"""
+Host stand-in for MicroPython's 'micropython' module.
+
+@micropython.viper functions run as plain Python: arguments annotated ptr8,
+ptr16 or ptr32 are turned into memoryviews of the buffer (unsigned bytes,
+unsigned 16-bit, signed 32-bit words, like viper loads), other arguments pass
+through. uint() values wrap at 32 bits like viper's uint, and int() of one
+reinterprets the bits as signed, as the viper cast does, so it can be stored
+through a ptr32. Plain ints don't wrap, so kernels must keep int values within
+32 bits, as they already have to on the device to avoid overflow.
+"""
+import builtins
+import functools
+import inspect
+
+
+def _cast(obj, fmt):
+    mv = memoryview(obj)
+    if mv.format != 'B':
+        mv = mv.cast('B')
+    return mv.cast(fmt)
+
+
+class ptr8:
+    fmt = 'B'
+
+    def __new__(cls, obj):
+        return _cast(obj, cls.fmt)
+
+
+class ptr16(ptr8):
+    fmt = 'H'
+
+
+class ptr32(ptr8):
+    fmt = 'i'
+
+
+_U32 = 0xFFFFFFFF
+
+
+class uint(int):
+    """viper uint: arithmetic and shifts wrap at 32 bits, >> is logical"""
+    def __new__(cls, x=0):
+        return int.__new__(cls, int(x) & _U32)
+
+    def __int__(self):
+        v = int.__int__(self)
+        return v - (1 << 32) if v & 0x80000000 else v
+
+    def __add__(self, o):
+        return uint(int.__add__(self, int(o)))
+
+    def __sub__(self, o):
+        return uint(int.__sub__(self, int(o)))
+
+    def __mul__(self, o):
+        return uint(int.__mul__(self, int(o)))
+
+    def __lshift__(self, o):
+        return uint(int.__lshift__(self, int(o)))
+
+    def __rshift__(self, o):
+        return uint(int.__rshift__(self, int(o)))
+
+    def __and__(self, o):
+        return uint(int.__and__(self, int(o) & _U32))
+
+    def __or__(self, o):
+        return uint(int.__or__(self, int(o) & _U32))
+
+    def __xor__(self, o):
+        return uint(int.__xor__(self, int(o) & _U32))
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+    __rand__ = __and__
+    __ror__ = __or__
+    __rxor__ = __xor__
+
+
+# viper type names are builtins on the device
+builtins.ptr8 = ptr8
+builtins.ptr16 = ptr16
+builtins.ptr32 = ptr32
+builtins.uint = uint
+
+
+def viper(f):
+    casts = [p.annotation if isinstance(p.annotation, type) and issubclass(p.annotation, ptr8) else None
+             for p in inspect.signature(f).parameters.values()]
+
+    @functools.wraps(f)
+    def wrapper(*args):
+        return f(*[c(a) if c is not None else a for c, a in zip(casts, args)])
+    return wrapper
+
+
+def native(f):
+    return f
+
+
+def const(x):
+    return x
+
+
+def schedule(func, arg):
+    func(arg)
+    return True
+
+
+def alloc_emergency_exception_buf(size):
+    pass
+
+
+def mem_info(*args):
+    pass
+
+
+def opt_level(*args):
+    return 0
@@ -0,0 +1,92 @@
+"""
+MicroPython extensions of standard modules, patched into CPython's so the
+firmware runs unchanged on a workstation:
+  time     ticks_ms/ticks_us/ticks_cpu (wrapping at 2**30 like the RP2 port),
+           ticks_diff, ticks_add, sleep_ms, sleep_us
+  gc       mem_free/mem_alloc against a simulated heap of HEAP_BYTES
+  os       ilistdir
+  asyncio  sleep_ms, wait_for_ms, StreamReader.readinto
+
+install() applies them; patch_firmware(network_controller) replaces the
+firmware's socket-readiness helper, which relies on MicroPython's asyncio
+internals (asyncio.core._io_queue), with an event-loop reader.
+"""
+import asyncio
+import gc
+import os
+import time
+
+TICKS_PERIOD = 1 << 30
+HEAP_BYTES = 200 * 1024
+
+_T0 = time.perf_counter_ns()
+
+
+def _ticks_ms():
+    return ((time.perf_counter_ns() - _T0) // 1000000) % TICKS_PERIOD
+
+
+def _ticks_us():
+    return ((time.perf_counter_ns() - _T0) // 1000) % TICKS_PERIOD
+
+
+def _ticks_cpu():
+    return (time.perf_counter_ns() - _T0) % TICKS_PERIOD
+
+
+def _ticks_diff(a, b):
+    return ((a - b + TICKS_PERIOD // 2) % TICKS_PERIOD) - TICKS_PERIOD // 2
+
+
+def _ticks_add(a, b):
+    return (a + b) % TICKS_PERIOD
+
+
+def _ilistdir(path='.'):
+    for entry in os.scandir(path):
+        kind = 0x4000 if entry.is_dir() else 0x8000
+        yield (entry.name, kind, entry.inode(), 0 if kind == 0x4000 else entry.stat().st_size)
+
+
+async def _readinto(self, buf):
+    data = await self.read(len(buf))
+    buf[:len(data)] = data
+    return len(data)
+
+
+def install(heap_bytes=HEAP_BYTES):
+    """Patch the MicroPython-only functions into time, gc, os and asyncio"""
+    time.ticks_ms = _ticks_ms
+    time.ticks_us = _ticks_us
+    time.ticks_cpu = _ticks_cpu
+    time.ticks_diff = _ticks_diff
+    time.ticks_add = _ticks_add
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+
+    gc.mem_free = lambda: heap_bytes
+    gc.mem_alloc = lambda: 0
+
+    if not hasattr(os, 'ilistdir'):
+        os.ilistdir = _ilistdir
+
+    asyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    asyncio.wait_for_ms = lambda aw, ms: asyncio.wait_for(aw, ms / 1000)
+    asyncio.StreamReader.readinto = _readinto
+
+
+async def readable(sock):
+    """Wait until sock has data (stand-in for the firmware's _readable)"""
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    fd = sock.fileno()
+    loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(fd)
+
+
+def patch_firmware(network_controller):
+    """Point the imported firmware network module at host equivalents"""
+    network_controller._readable = readable
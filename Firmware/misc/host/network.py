@@ -0,0 +1,61 @@
+"""
+Host stand-in for MicroPython's 'network' module.
+
+WLAN connects at once and reports the host address (WLAN.host_ip, localhost by
+default), so the firmware's servers bind real sockets on this machine.
+WLAN.link_up can be cleared to exercise the reconnect path.
+"""
+STA_IF = 0
+AP_IF = 1
+
+STAT_IDLE = 0
+STAT_CONNECTING = 1
+STAT_WRONG_PASSWORD = -3
+STAT_NO_AP_FOUND = -2
+STAT_CONNECT_FAIL = -1
+STAT_GOT_IP = 3
+
+
+class WLAN:
+    host_ip = '127.0.0.1'
+    link_up = True
+
+    def __init__(self, interface=STA_IF):
+        self.interface = interface
+        self._active = False
+        self._connected = False
+        self.ssid = None
+
+    def active(self, state=None):
+        if state is None:
+            return self._active
+        self._active = bool(state)
+        if not self._active:
+            self._connected = False
+
+    def connect(self, ssid=None, key=None, **kwargs):
+        self.ssid = ssid
+        self._connected = True
+
+    def disconnect(self):
+        self._connected = False
+
+    def isconnected(self):
+        return self._active and self._connected and WLAN.link_up
+
+    def status(self, param=None):
+        if param == 'rssi':
+            return -40
+        return STAT_GOT_IP if self.isconnected() else STAT_IDLE
+
+    def ifconfig(self, config=None):
+        if config is not None:
+            return None
+        ip = WLAN.host_ip if self.isconnected() else '0.0.0.0'
+        return (ip, '255.255.255.0', ip, ip)
+
+    def config(self, *args, **kwargs):
+        if args == ('mac',):
+            return b'\x02\x00\x00\x00\x00\x01'
+        if args:
+            return None
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Host Firmware Runner
+--------------------
+Runs Firmware/main.py unchanged under CPython, with the stand-in machine,
+network and micropython modules next to this script and the MicroPython
+extensions from mpcompat.py. The HTTP and UDP servers listen on real sockets
+of this machine, and the I2S output is clocked at the sample rate (times
+--speed) into an optional WAV file, so the whole request -> playback path can
+be exercised, timed and profiled without a Pico.
+
+Example:
+  python3 run-firmware.py --root /tmp/pico --sink out.wav --duration 20 &
+  curl "http://127.0.0.1:8080/play?duration=2&source=tone"
+"""
+
+import argparse
+import cProfile
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+import _thread
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRMWARE = os.path.dirname(os.path.dirname(HERE))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Pico firmware on this machine")
+    parser.add_argument("--root", default=".",
+                        help="Directory standing in for the device filesystem (config.json, audio files, "
+                             "stimuli/); config.json is copied from Firmware/ if missing (default: .)")
+    parser.add_argument("--port", type=int, default=8080,
+                        help="HTTP port, replacing network.server_port (default: 8080)")
+    parser.add_argument("--sink", help="WAV file receiving everything written to I2S")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="I2S consume rate as a multiple of the sample rate (default: 1.0)")
+    parser.add_argument("--heap", type=int, default=200 * 1024,
+                        help="Value reported by gc.mem_free() (default: 204800)")
+    parser.add_argument("--duration", type=float,
+                        help="Stop after this many seconds (default: run until Ctrl-C)")
+    parser.add_argument("--profile", help="cProfile the audio (main) thread into this file")
+    parser.add_argument("--pins", action="store_true", help="Print output pin changes")
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    sink = os.path.abspath(args.sink) if args.sink else None
+    profile = os.path.abspath(args.profile) if args.profile else None
+    os.makedirs(root, exist_ok=True)
+    if not os.path.exists(os.path.join(root, "config.json")):
+        shutil.copy(os.path.join(FIRMWARE, "config.json"), root)
+    # main() opens audio.file at boot; give a fresh root one second of silence
+    with open(os.path.join(root, "config.json")) as f:
+        audio = json.load(f).get("audio", {})
+    placeholder = os.path.join(root, audio.get("file", "my_sound.raw"))
+    if not os.path.exists(placeholder):
+        with open(placeholder, "wb") as f:
+            f.write(bytes(audio.get("sample_rate", 44100) * 4))
+        print(f"Created silent {placeholder}")
+    sys.path[:0] = [HERE, FIRMWARE]
+
+    import mpcompat
+    mpcompat.install(args.heap)
+    import machine
+    machine.I2S.sink = sink
+    machine.I2S.speed = args.speed
+    if args.pins:
+        machine.Pin.on_change = lambda pin, value: print(f"[pin {pin}] {value}")
+
+    os.chdir(root)
+    import network_controller
+    mpcompat.patch_firmware(network_controller)
+    import main as firmware
+
+    load_config = firmware.load_config
+
+    def host_config():
+        config = load_config()
+        network = config.setdefault("network", {})
+        network["server_port"] = args.port
+        network["ssid"] = network.get("ssid") or "host"
+        network["password"] = network.get("password") or "host"
+        return config
+    firmware.load_config = host_config
+
+    # --duration: interrupt the main loop (repeatedly, as playback swallows the first one)
+    finished = threading.Event()
+    if args.duration:
+        def stop():
+            time.sleep(args.duration)
+            while not finished.is_set():
+                _thread.interrupt_main()
+                time.sleep(0.2)
+        threading.Thread(target=stop, daemon=True).start()
+
+    print(f"Firmware root {root}, HTTP on http://127.0.0.1:{args.port}")
+    profiler = cProfile.Profile() if profile else None
+    started = time.monotonic()
+    try:
+        if profiler is not None:
+            profiler.runcall(firmware.main)
+        else:
+            firmware.main()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        finished.set()
+        if profiler is not None:
+            profiler.dump_stats(profile)
+            print(f"Profile written to {profile}")
+        for i2s in list(machine.I2S.instances):
+            print(f"I2S: {i2s.frames_played} frames played, {i2s.underruns} underruns "
+                  f"({i2s.underrun_frames} frames) in {time.monotonic() - started:.1f} s")
+            i2s.deinit()
+        if sink:
+            print(f"Output written to {sink}")
+
+
+if __name__ == "__main__":
+    main()
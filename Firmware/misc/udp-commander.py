@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Pico 2W UDP Commander
+---------------------
+Client for the firmware's binary UDP command channel: play, stop, gain and volume
+as fixed-layout packets with sequence numbers, retried until acknowledged.
+Packet layouts mirror the constants at the top of Firmware/network_controller.py.
+"""
+
+import argparse
+import socket
+import struct
+import time
+
+UDP_MAGIC = b'ES'
+UDP_HEADER = '<2sBBH'
+UDP_ACK = '<2sBBHI'
+CMD_PLAY = 1
+CMD_STOP = 2
+CMD_GAIN = 3
+CMD_VOLUME = 4
+UDP_PLAY = '<BBIHHHHI'
+UDP_PLAY_FLAG_AT = 0x01
+SOURCES = {'file': 0, 'noise': 1, 'tone': 2}
+ACK_STATUS = {0: 'ok', 1: 'rejected', 2: 'bad packet'}
+
+
+def q15(volume):
+    return max(0, min(int(volume * 32767), 32767))
+
+
+class PicoUDPCommander:
+    def __init__(self, ip, port=5006, timeout=0.05, retries=5):
+        self.addr = (ip, port)
+        self.retries = retries
+        self.seq = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.settimeout(timeout)
+
+    def send(self, command, payload=b''):
+        """Send a command and wait for its ack; returns (status, device_ticks_us, rtt_ms)"""
+        self.seq = (self.seq + 1) & 0xFFFF
+        packet = struct.pack(UDP_HEADER, UDP_MAGIC, command, 0, self.seq) + payload
+        for _ in range(self.retries):
+            start = time.perf_counter()
+            self.sock.sendto(packet, self.addr)
+            try:
+                while True:
+                    data, _ = self.sock.recvfrom(64)
+                    magic, cmd, status, seq, ticks = struct.unpack(UDP_ACK, data[:10])
+                    if magic == UDP_MAGIC and cmd == command | 0x80 and seq == self.seq:
+                        return ACK_STATUS.get(status, status), ticks, (time.perf_counter() - start) * 1000
+            except socket.timeout:
+                continue
+        raise TimeoutError(f"No ack for command {command} seq {self.seq}")
+
+    def play(self, duration, volume_left, volume_right, source='file', freq_a=0, freq_b=0, at=None):
+        flags = UDP_PLAY_FLAG_AT if at is not None else 0
+        payload = struct.pack(UDP_PLAY, SOURCES[source], flags, int(duration * 1000),
+                              q15(volume_left), q15(volume_right), int(freq_a), int(freq_b),
+                              at if at is not None else 0)
+        return self.send(CMD_PLAY, payload)
+
+    def stop(self, immediate=False):
+        return self.send(CMD_STOP, struct.pack('<B', 1 if immediate else 0))
+
+    def gain(self, level):
+        return self.send(CMD_GAIN, struct.pack('<B', level))
+
+    def volume(self, volume_left, volume_right, ramp_ms=20):
+        return self.send(CMD_VOLUME, struct.pack('<HHH', q15(volume_left), q15(volume_right), ramp_ms))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Send binary UDP commands to a Pico 2W')
+    parser.add_argument('--ip', type=str, default='192.168.86.215',
+                        help='IP address of the Pico 2W (default: 192.168.86.215)')
+    parser.add_argument('--port', type=int, default=5006, help='UDP command port (default: 5006)')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('play')
+    p.add_argument('--duration', type=float, default=1.0)
+    p.add_argument('--volume-left', type=float, default=0.3)
+    p.add_argument('--volume-right', type=float, default=0.3)
+    p.add_argument('--source', choices=sorted(SOURCES), default='file')
+    p.add_argument('--freq-a', type=int, default=0, help='noise min / tone frequency (Hz)')
+    p.add_argument('--freq-b', type=int, default=0, help='noise max / second tone frequency (Hz)')
+    p = sub.add_parser('stop')
+    p.add_argument('--immediate', action='store_true')
+    p = sub.add_parser('gain')
+    p.add_argument('level', type=int, choices=range(4))
+    p = sub.add_parser('volume')
+    p.add_argument('volume_left', type=float)
+    p.add_argument('volume_right', type=float)
+    p.add_argument('--ramp-ms', type=int, default=20)
+    args = parser.parse_args()
+
+    pico = PicoUDPCommander(args.ip, args.port)
+    if args.command == 'play':
+        result = pico.play(args.duration, args.volume_left, args.volume_right,
+                           args.source, args.freq_a, args.freq_b)
+    elif args.command == 'stop':
+        result = pico.stop(args.immediate)
+    elif args.command == 'gain':
+        result = pico.gain(args.level)
+    else:
+        result = pico.volume(args.volume_left, args.volume_right, args.ramp_ms)
+    status, ticks, rtt = result
+    print(f"Ack: {status} (device ticks_us={ticks}, round trip {rtt:.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,8 +2,88 @@ import argparse
 import wave
 import audioop
 import os
+import struct
+import sys
+from array import array
 
-def convert_wav(input_path, output_path, target_rate, target_width, target_channels):
+# IMA-ADPCM container read by Firmware/adpcm_file_player.py
+ADPCM_MAGIC = b'IMA1'
+ADPCM_HEADER = '<4sBBHII'
+IMA_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767)
+IMA_INDEX = (-1, -1, -1, -1, 2, 4, 6, 8)
+
+
+def ima_encode_sample(sample, state):
+    """Encode one 16-bit sample; state is [predictor, step_index], updated exactly as the decoder does"""
+    pred, index = state
+    step = IMA_STEPS[index]
+    diff = sample - pred
+    code = 0
+    if diff < 0:
+        code = 8
+        diff = -diff
+    if diff >= step:
+        code |= 4
+        diff -= step
+    if diff >= step >> 1:
+        code |= 2
+        diff -= step >> 1
+    if diff >= step >> 2:
+        code |= 1
+    # reconstruct like the decoder so both stay in lock step
+    d = step >> 3
+    if code & 4:
+        d += step
+    if code & 2:
+        d += step >> 1
+    if code & 1:
+        d += step >> 2
+    pred = pred - d if code & 8 else pred + d
+    state[0] = max(-32768, min(32767, pred))
+    state[1] = max(0, min(88, index + IMA_INDEX[code & 7]))
+    return code
+
+
+def encode_ima_adpcm(frames, channels, rate, block_frames=1024):
+    """
+    Encode interleaved 16-bit PCM into the firmware's blocked IMA-ADPCM format
+    (4 bits per sample). Every block starts with the per-channel decoder state,
+    so blocks decode independently and the loop back to the start is seamless.
+    """
+    samples = array('h')
+    samples.frombytes(frames)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    total = len(samples) // channels
+    states = [[samples[c], 0] if total else [0, 0] for c in range(channels)]
+    out = bytearray(struct.pack(ADPCM_HEADER, ADPCM_MAGIC, channels, 0, block_frames, rate, total))
+    block_bytes = 4 * channels + (block_frames * channels + 1) // 2
+    for start in range(0, total, block_frames):
+        block = bytearray()
+        for c in range(channels):
+            block += struct.pack('<hBB', states[c][0], states[c][1], 0)
+        codes = []
+        for i in range(start, min(start + block_frames, total)):
+            for c in range(channels):
+                codes.append(ima_encode_sample(samples[i * channels + c], states[c]))
+        # two codes per byte, first one in the low nibble
+        if len(codes) & 1:
+            codes.append(0)
+        for k in range(0, len(codes), 2):
+            block.append(codes[k] | (codes[k + 1] << 4))
+        block += bytes(block_bytes - len(block))
+        out += block
+    return bytes(out)
+
+
+def convert_wav(input_path, output_path, target_rate, target_width, target_channels, adpcm=False):
     # Open source WAV
     with wave.open(input_path, 'rb') as wf:
         in_channels = wf.getnchannels()
@@ -30,7 +110,12 @@ def convert_wav(input_path, output_path, target_rate, target_width, target_chann
         print(f"Resampling from {in_rate} Hz to {target_rate} Hz.")
         frames, _ = audioop.ratecv(frames, target_width, target_channels, in_rate, target_rate, None)
     
-    # Write raw PCM output
+    if adpcm:
+        pcm_bytes = len(frames)
+        frames = encode_ima_adpcm(frames, target_channels, target_rate)
+        print(f"IMA-ADPCM encoded: {pcm_bytes} -> {len(frames)} bytes")
+
+    # Write raw PCM (or ADPCM) output
     with open(output_path, 'wb') as outf:
         outf.write(frames)
     print(f"Converted file saved to {output_path}")
@@ -41,23 +126,27 @@ def main():
     )
     parser.add_argument("input_wav", help="Path to input WAV file")
     parser.add_argument("output_raw", nargs='?',
-                        help="Path to output raw PCM file (default: same name with .raw)")
+                        help="Path to output raw PCM file (default: same name with .raw, or .adpcm with --adpcm)")
     parser.add_argument("--rate", type=int, default=44100,
                         help="Target sample rate in Hz (default: 44100)")
     parser.add_argument("--width", type=int, choices=[1,2,3,4], default=2,
                         help="Target sample width in bytes (default: 2 for 16-bit)")
     parser.add_argument("--channels", type=int, choices=[1,2], default=2,
                         help="Target number of channels (1=mono, 2=stereo) (default: 2)")
+    parser.add_argument("--adpcm", action="store_true",
+                        help="Emit 4:1 IMA-ADPCM (16-bit input only) for adpcm_file_player.py")
     args = parser.parse_args()
+    if args.adpcm and args.width != 2:
+        parser.error("--adpcm needs --width 2")
 
     input_path = args.input_wav
     if args.output_raw:
         output_path = args.output_raw
     else:
         base, _ = os.path.splitext(input_path)
-        output_path = base + ".raw"
+        output_path = base + (".adpcm" if args.adpcm else ".raw")
 
-    convert_wav(input_path, output_path, args.rate, args.width, args.channels)
+    convert_wav(input_path, output_path, args.rate, args.width, args.channels, args.adpcm)
 
 if __name__ == "__main__":
     main()
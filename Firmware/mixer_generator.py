@@ -0,0 +1,113 @@
+import micropython
+from array import array
+
+# --------------------
+# two-source stereo mixer: left output from source a, right output from source b.
+# Sources are read as 16-bit samples at index i * stride + offset, so a mono
+# source uses (1, 0) and one channel of a stereo source uses (2, 0) or (2, 1).
+# p is a ptr32 block (see _MX_* indices):
+#   [frames, gain_a_q15, stride_a, offset_a, gain_b_q15, stride_b, offset_b]
+@micropython.viper
+def _viper_mix(dst: ptr32, a: ptr16, b: ptr16, p: ptr32):
+    frames = p[0]
+    ga = p[1]
+    sa = p[2]
+    oa = p[3]
+    gb = p[4]
+    sb = p[5]
+    ob = p[6]
+    i = int(0)
+    while i < frames:
+        l = ((a[i * sa + oa] ^ 0x8000) - 0x8000) * ga >> 15
+        r = ((b[i * sb + ob] ^ 0x8000) - 0x8000) * gb >> 15
+        dst[i] = (l & 0xFFFF) | (r << 16)
+        i += 1
+
+
+# parameter block layout shared with _viper_mix
+_MX_FRAMES = 0
+_MX_GAIN_A = 1
+_MX_STRIDE_A = 2
+_MX_OFFSET_A = 3
+_MX_GAIN_B = 4
+_MX_STRIDE_B = 5
+_MX_OFFSET_B = 6
+
+_CHANNELS = {'left': 0, 'right': 1}
+
+
+class MixerGenerator:
+    """
+    Builds a stereo stimulus from two mono sources (e.g. a texture file on the
+    left and noise on the right, as ABXTester's StereoAudioPlayer does), with the
+    same generate_buffer(desired_frames) contract as RawFilePlayer.
+
+    Each source is any 16-bit wave generator: a mono RawFilePlayer is used as is;
+    from a stereo one (noise, tone, stereo raw file) one channel is taken
+    ('left' by default). Each source has its own Q15 gain, applied while the
+    two are interleaved in viper.
+
+    Output is 16-bit stereo. Returned buffers are only valid until the next call.
+    """
+    def __init__(self, config, left=None, right=None, gain_left=1.0, gain_right=1.0):
+        self.config = config
+        self.audio_cfg = config["audio"]
+        if self.audio_cfg["bits_per_sample"] != 16:
+            raise ValueError("MixerGenerator mixes 16-bit sources only")
+        self.frame_size = 4
+        self.params = array('i', [0, 32767, 1, 0, 32767, 1, 0])
+        self.left = None
+        self.right = None
+        if left is not None and right is not None:
+            self.set_sources(left, right, gain_left, gain_right)
+
+        # Output buffer (allocated on first generate_buffer call)
+        self.buffer = None
+        self.view = None
+        self.buf_bytes = 0
+
+    def _route(self, source, channel, base):
+        """Set stride/offset for one source from its frame size"""
+        if channel not in _CHANNELS:
+            raise ValueError(f"Invalid mixer channel: {channel}")
+        channels = source.frame_size // 2
+        if channels not in (1, 2):
+            raise ValueError("Mixer sources must be 16-bit mono or stereo")
+        self.params[base + 1] = channels
+        self.params[base + 2] = _CHANNELS[channel] if channels == 2 else 0
+
+    def set_sources(self, left, right, gain_left=1.0, gain_right=1.0,
+                    left_channel='left', right_channel='left'):
+        """
+        Route 'left' to the left output and 'right' to the right output with
+        gains in [0.0, 1.0]; left_channel/right_channel pick which channel of a
+        stereo source is used.
+        """
+        if left is right:
+            raise ValueError("Mixer sources must be two different generators")
+        self._route(left, left_channel, _MX_GAIN_A)
+        self._route(right, right_channel, _MX_GAIN_B)
+        self.set_gains(gain_left, gain_right)
+        self.left = left
+        self.right = right
+
+    def set_gains(self, gain_left, gain_right):
+        """Per-source gains (floats in [0.0, 1.0]), applied from the next buffer"""
+        self.params[_MX_GAIN_A] = max(0, min(int(gain_left * 32767), 32767))
+        self.params[_MX_GAIN_B] = max(0, min(int(gain_right * 32767), 32767))
+
+    def generate_buffer(self, desired_frames):
+        """
+        Returns a memoryview for the next stereo buffer of 'desired_frames'.
+        """
+        num_bytes = desired_frames * self.frame_size
+        if self.buf_bytes != num_bytes:
+            self.buffer = bytearray(num_bytes)
+            self.view = memoryview(self.buffer)
+            self.buf_bytes = num_bytes
+        # both sources keep their buffers valid until their own next call
+        a = self.left.generate_buffer(desired_frames)
+        b = self.right.generate_buffer(desired_frames)
+        self.params[_MX_FRAMES] = desired_frames
+        _viper_mix(self.buffer, a, b, self.params)
+        return self.view
@@ -1,10 +1,55 @@
 import network
+import asyncio
 import socket
+import struct
 import time
 import json
 import _thread
 from machine import Pin
 import gc
+import os
+from trace_ring import FIELDS as TRACE_FIELDS
+from stimulus_library import stimulus_kind
+from tone_generator import MAX_TONES
+from http_response import ResponseWriter
+
+try:
+    from binascii import crc32
+except ImportError:
+    crc32 = None
+
+# Binary UDP command channel (control_port). Little-endian, fixed layout:
+#   header  '<2sBBH'  magic b'ES', command, flags, sequence number
+#   PLAY    '<BBIHHHHI' source, play flags, duration_ms, volume_left_q15,
+#                       volume_right_q15, freq_a_hz, freq_b_hz, at_ticks_us
+#   STOP    '<B'        immediate (0/1)
+#   GAIN    '<B'        level 0..3
+#   VOLUME  '<HHH'      volume_left_q15, volume_right_q15, ramp_ms
+# Every packet is acknowledged with '<2sBBHI': magic, command | 0x80, status,
+# sequence number, device ticks_us when handled. A repeated sequence number is
+# re-acknowledged without being executed again.
+UDP_MAGIC = b'ES'
+UDP_HEADER = '<2sBBH'
+UDP_HEADER_SIZE = 6
+UDP_ACK = '<2sBBHI'
+CMD_PLAY = 1
+CMD_STOP = 2
+CMD_GAIN = 3
+CMD_VOLUME = 4
+UDP_PLAY = '<BBIHHHHI'
+UDP_PLAY_SIZE = 18
+UDP_PLAY_FLAG_AT = 0x01
+UDP_SOURCES = ('file', 'noise', 'tone')
+MIX_SOURCES = ('file', 'noise', 'tone')
+ACK_OK = 0
+ACK_REJECTED = 1
+ACK_BAD_PACKET = 2
+
+
+def _readable(sock):
+    """Await-able that parks the current task until sock has data (asyncio's stream idiom)"""
+    yield asyncio.core._io_queue.queue_read(sock)
+
 
 class WiFiController:
     def __init__(self, config):
@@ -20,6 +65,27 @@ class WiFiController:
         self.max_retry_delay = self.network_config.get("max_retry_delay_ms", 30000)
         self.backoff_factor = self.network_config.get("backoff_factor", 2)
 
+        # Server / housekeeping parameters
+        self.client_timeout_ms = self.network_config.get("client_timeout_ms", 3000)
+        self.keepalive_ms = self.network_config.get("keepalive_ms", 5000)
+        # One response buffer shared by all connections (see http_response.ResponseWriter)
+        self.responses = ResponseWriter(self.network_config.get("response_buffer_bytes", 2048))
+        # Concurrent connections served; more are answered with 503 and closed
+        self.max_clients = self.network_config.get("max_clients", 4)
+        self.clients = 0
+        self.heartbeat_ms = self.network_config.get("heartbeat_ms", 1000)
+        self.gc_interval_ms = self.network_config.get("gc_interval_ms", 5000)
+        self.wifi_check_ms = self.network_config.get("wifi_check_ms", 1000)
+        self.server = None
+
+        # Clock sync (UDP) and scheduled playback
+        self.sync_port = self.network_config.get("sync_port", 5005)
+        self.max_schedule_ms = self.network_config.get("max_schedule_ms", 60000)
+        self.sync_socket = None
+        self.control_port = self.network_config.get("control_port", 5006)
+        self.control_socket = None
+        self.volume_request = None
+
         # State variables
         self.wifi_connected = False
         self.server_running = False
@@ -27,8 +93,40 @@ class WiFiController:
         
         # Initialize shared resources and synchronization
         self.play_request_lock = _thread.allocate_lock()
-        self.play_request = None
-        self.gain_request = None
+        self.play_queue = []
+        # Set once the audio loop has taken a request off the queue, until playback_finished
+        self.playback_started = False
+        self.max_queue = self.network_config.get("max_queue", 16)
+        self.max_body_bytes = self.network_config.get("max_body_bytes", 4096)
+        # File uploads (PUT /files/<name>): one reusable chunk buffer, and the
+        # paths replaced since the audio loop last looked (stale open players)
+        self.upload_buffer = bytearray(self.network_config.get("upload_chunk_bytes", 4096))
+        self.upload_dir = config["audio"].get("library_dir", "stimuli")
+        self.uploading = False
+        self.replaced_files = []
+        self.stop_request = None
+        self.stop_timeout_ms = self.network_config.get("stop_timeout_ms", 1000)
+        self.last_stop_us = None
+        self.last_frames_played = None
+        # Buffer calibration: pending request flag and last result
+        self.calibrate_request = False
+        self.calibrating = False
+        self.calibration = None
+
+        # Extra coroutines run on this core's event loop (e.g. the pipelined
+        # audio producer), added by main before start()
+        self.tasks = []
+
+        # Playback trace ring and health counters, attached by main
+        # (see HardwareController.trace / .metrics)
+        self.trace = None
+        self.metrics = None
+        self.pipeline = None
+        # Live volume/balance/gain block read by the audio loop once per buffer
+        # (see control_block.ControlBlock), attached by main
+        self.control = None
+        # Stimulus index (see stimulus_library.StimulusLibrary), attached by main
+        self.library = None
         
         # LEDs - get pin numbers from config
         pins = config.get("pins", {})
@@ -69,8 +167,12 @@ class WiFiController:
             self.set_all_leds(False)
             time.sleep_ms(interval_ms)
 
-    def connect_wifi(self):
-        """Connect to WiFi with exponential backoff and improved error handling"""
+    async def connect_wifi(self):
+        """
+        Connect to WiFi with exponential backoff and improved error handling.
+        Status polls and retry delays await instead of sleeping, so the rest of
+        the event loop (clients, UDP, the pipeline producer) keeps running.
+        """
         try:
             if not self.ssid or not self.password:
                 print("WiFi credentials not configured")
@@ -98,7 +200,7 @@ class WiFiController:
                         print(f"Connected to WiFi. IP: {ip}")
                         self.wifi_connected = True
                         return True
-                    time.sleep_ms(800)
+                    await asyncio.sleep_ms(800)
                 
                 # If we got here, connection failed
                 retry_count += 1
@@ -113,7 +215,7 @@ class WiFiController:
                 print(f"Retrying in {retry_delay}ms (attempt {retry_count+1}/{self.max_retries})")
                 
                 # Simple wait without LED blinking for testing
-                time.sleep_ms(retry_delay)
+                await asyncio.sleep_ms(retry_delay)
             
             return False
         except Exception as e:
@@ -122,18 +224,15 @@ class WiFiController:
             sys.print_exception(e)  # Print full exception details
             return False   
     
-    def start_server(self):
-        """Start a simple HTTP server"""
+    async def start_server(self):
+        """Start the asyncio HTTP server"""
         if not self.wifi_connected:
             print("Cannot start server: WiFi not connected")
             return False
         
         try:
-            addr = socket.getaddrinfo('0.0.0.0', self.server_port)[0][-1]
-            self.socket = socket.socket()
-            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.socket.bind(addr)
-            self.socket.listen(1)
+            self.server = await asyncio.start_server(
+                self.handle_client, '0.0.0.0', self.server_port, backlog=self.max_clients)
             
             print(f"Server started on port {self.server_port}")
             self.server_running = True
@@ -141,6 +240,17 @@ class WiFiController:
         except Exception as e:
             print(f"Failed to start server: {e}")
             return False
+
+    async def stop_server(self):
+        """Close the listening socket (open connections finish on their own)"""
+        self.server_running = False
+        if self.server is not None:
+            try:
+                self.server.close()
+                await self.server.wait_closed()
+            except Exception:
+                pass
+            self.server = None
     
     def parse_request(self, request):
         """Parse an HTTP request and extract parameters"""
@@ -149,8 +259,8 @@ class WiFiController:
             request_line = request.split('\r\n')[0]
             method, path, _ = request_line.split(' ')
             
-            if method != 'GET':
-                return {'error': 'Only GET requests are supported'}
+            if method not in ('GET', 'POST', 'PUT'):
+                return {'error': 'Only GET, POST and PUT requests are supported'}
             
             # Parse path and query parameters
             if '?' in path:
@@ -160,57 +270,470 @@ class WiFiController:
                     if '=' in param:
                         key, value = param.split('=', 1)
                         params[key] = value
-                return {'path': path, 'params': params}
+                return {'method': method, 'path': path, 'params': params}
             else:
-                return {'path': path, 'params': {}}
+                return {'method': method, 'path': path, 'params': {}}
         except Exception as e:
             print(f"Error parsing request: {e}")
             return {'error': 'Invalid request format'}
     
-    def handle_request(self, client_sock, addr):
-        """Handle an HTTP request from a client"""
+    def parse_tones(self, params):
+        """
+        Build a (frequency, amplitude, channel) list from comma-separated
+        'frequency', 'amplitude' and 'channel' parameters, or None if no
+        frequency is given. Missing amplitudes/channels repeat the last value.
+        """
+        if 'frequency' not in params:
+            return None
+        frequencies = [float(f) for f in str(params['frequency']).split(',')]
+        amplitudes = [float(a) for a in str(params.get('amplitude', '1.0')).split(',')]
+        channels = str(params.get('channel', 'both')).split(',')
+        tones = []
+        for i, frequency in enumerate(frequencies):
+            tones.append((frequency,
+                          amplitudes[min(i, len(amplitudes) - 1)],
+                          channels[min(i, len(channels) - 1)]))
+        return self.check_tones(tones)
+
+    def check_tones(self, tones):
+        """
+        Validate a tone list from query parameters or a JSON segment and return
+        it as (frequency, amplitude, channel) tuples. JSON entries may be a bare
+        frequency, a [frequency, amplitude, channel] list (trailing items
+        optional) or an object with those keys. Raises ValueError on a bad
+        shape, count or range, so nothing invalid reaches ToneGenerator.
+        """
+        if not isinstance(tones, (list, tuple)) or not 1 <= len(tones) <= MAX_TONES:
+            raise ValueError(f'tones must be a list of 1 to {MAX_TONES} tones')
+        nyquist = self.config["audio"].get("sample_rate", 44100) / 2
+        checked = []
+        for tone in tones:
+            if isinstance(tone, dict):
+                tone = (tone.get('frequency'), tone.get('amplitude', 1.0), tone.get('channel', 'both'))
+            elif isinstance(tone, (list, tuple)):
+                if not 1 <= len(tone) <= 3:
+                    raise ValueError('a tone is [frequency, amplitude, channel]')
+                tone = tuple(tone) + (1.0, 'both')[len(tone) - 1:]
+            else:
+                tone = (tone, 1.0, 'both')
+            frequency, amplitude, channel = tone
+            if isinstance(frequency, bool) or not isinstance(frequency, (int, float)):
+                raise ValueError('tone frequency must be a number')
+            if isinstance(amplitude, bool) or not isinstance(amplitude, (int, float)):
+                raise ValueError('tone amplitude must be a number')
+            if not 0 < frequency < nyquist:
+                raise ValueError(f'tone frequency must be between 0 and {nyquist} Hz')
+            if not 0 <= amplitude <= 1:
+                raise ValueError('tone amplitude must be 0.0..1.0')
+            if channel not in ('left', 'right', 'both'):
+                raise ValueError(f'invalid tone channel: {channel}')
+            checked.append((float(frequency), float(amplitude), channel))
+        return checked
+
+    def resolve_file(self, filename):
+        """
+        Map a file= parameter to the path to play: None for the configured
+        audio.file (the default player), otherwise a .wav/.adpcm/.raw file in the
+        stimulus library directory, given by name or as <library_dir>/<name>.
+        Anything else (config.json, scripts, other directories) raises ValueError,
+        as it would be streamed into the amplifier as raw PCM.
+        """
+        if filename == self.config["audio"].get("file", "my_sound.raw"):
+            return None
+        prefix = self.upload_dir + '/'
+        if filename.startswith(prefix):
+            filename = filename[len(prefix):]
+        if not filename or '/' in filename or filename.startswith('.') or stimulus_kind(filename) is None:
+            raise ValueError(f'file must be audio.file or a .wav, .adpcm or .raw file in {self.upload_dir}')
+        return prefix + filename
+
+    def make_play_request(self, params):
+        """
+        Build a play request (one playlist segment) from query parameters or a
+        JSON segment object. Raises ValueError on malformed values.
+        """
+        duration = float(params.get('duration', 5.0))
+        # inf, nan and negative values would play until stopped (or not at all)
+        if not 0 <= duration < float('inf'):
+            raise ValueError('duration must be a finite number of seconds >= 0')
+        volume = float(params.get('volume', 0.5))
+        min_frequency = params.get('min_frequency')
+        max_frequency = params.get('max_frequency')
+        # Optional scheduled start, in device ticks_us (see sync_task)
+        at = params.get('at')
+        if at is not None:
+            at = int(at)
+            if time.ticks_diff(at, time.ticks_us()) > self.max_schedule_ms * 1000:
+                raise ValueError(f'at is more than {self.max_schedule_ms} ms ahead')
+        # Wave source: 'file' (raw PCM), 'noise' or 'tone' (on-device synthesis),
+        # or 'mix' (one mono source per channel, each with its own gain)
+        source = params.get('source', 'file')
+        # Optional stimulus file for 'file' (and mixed file) playback: by library
+        # name (index lookup, with its loop points) or by file name
+        filename = params.get('file')
+        loop = None
+        if filename is not None:
+            filename = self.resolve_file(str(filename))
+        name = params.get('name')
+        if name is not None:
+            entry = self.library.lookup(name) if self.library is not None else None
+            if entry is None:
+                raise ValueError(f'unknown stimulus: {name}')
+            filename = entry[0]
+            loop = (entry[4], entry[5])
+        tones = None
+        mix = None
+        if source == 'mix':
+            mix = {
+                'left': params.get('left', 'file'),
+                'right': params.get('right', 'noise'),
+                'left_gain': float(params.get('left_gain', 1.0)),
+                'right_gain': float(params.get('right_gain', 1.0))
+            }
+            if mix['left'] not in MIX_SOURCES or mix['right'] not in MIX_SOURCES:
+                raise ValueError(f'mix sources must be one of {MIX_SOURCES}')
+            if mix['left'] == mix['right']:
+                raise ValueError('mix needs two different sources')
+        if source == 'noise' or (mix and 'noise' in (mix['left'], mix['right'])):
+            # every noise request gets a band: its own, else the config defaults
+            audio = self.config["audio"]
+            min_frequency = float(min_frequency if min_frequency is not None
+                                  else audio.get("noise_min_frequency", 0))
+            max_frequency = float(max_frequency if max_frequency is not None
+                                  else audio.get("noise_max_frequency", audio["sample_rate"] // 2))
+            if min_frequency < 0 or max_frequency <= min_frequency:
+                raise ValueError('noise band must satisfy 0 <= min_frequency < max_frequency')
+        else:
+            min_frequency = max_frequency = None
+        if source == 'tone' or (mix and 'tone' in (mix['left'], mix['right'])):
+            tones = params.get('tones')
+            tones = self.check_tones(tones) if tones is not None else self.parse_tones(params)
+        return {
+            'duration': duration,
+            'volume': volume,
+            # Per-channel volumes default to the overall volume
+            'volume_left': float(params.get('volume_left', volume)),
+            'volume_right': float(params.get('volume_right', volume)),
+            'source': source,
+            'file': filename,
+            'loop': loop,
+            'min_frequency': min_frequency,
+            'max_frequency': max_frequency,
+            'tones': tones,
+            'mix': mix,
+            'at': at
+        }
+
+    def enqueue_play_requests(self, requests):
+        """
+        Append segments to the play queue. Returns the queue length, or None
+        (queue untouched) if they don't all fit. A scheduled start ('at') is only
+        honoured by a request that starts playback, so one that would be spliced
+        in behind other audio raises ValueError.
+        """
+        for request in requests[1:]:
+            if request['at'] is not None:
+                raise ValueError('only the first segment of a playlist can have at')
+        with self.play_request_lock:
+            if requests[0]['at'] is not None and self.audio_playing:
+                raise ValueError('at needs an idle player (queued segments start at the splice)')
+            if self.uploading or len(self.play_queue) + len(requests) > self.max_queue:
+                return None
+            if not self.audio_playing:
+                self.stop_request = None
+            self.play_queue.extend(requests)
+            self.audio_playing = True
+            return len(self.play_queue)
+
+    async def handle_client(self, reader, writer):
+        """
+        Serve one HTTP connection. HTTP/1.1 clients (and HTTP/1.0 ones sending
+        Connection: keep-alive) get further requests on the same connection
+        until they send Connection: close or stay idle for network.keepalive_ms.
+        """
+        served = 0
+        if self.clients >= self.max_clients:
+            try:
+                writer.write(self.responses.render(503, {'status': 'error', 'message': 'Too many connections'}, False))
+                await asyncio.wait_for_ms(writer.drain(), self.client_timeout_ms)
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+            return
+        self.clients += 1
+        try:
+            while True:
+                # Request line (idle keep-alive connections just close), then headers
+                try:
+                    request = await asyncio.wait_for_ms(reader.readline(),
+                                                        self.keepalive_ms if served else self.client_timeout_ms)
+                except asyncio.TimeoutError:
+                    if not served:
+                        raise
+                    return
+                if not request:
+                    return
+                keep_alive = request.rstrip().endswith(b'HTTP/1.1')
+                content_length = 0
+                expect_continue = False
+                crc_header = None
+                while True:
+                    line = await asyncio.wait_for_ms(reader.readline(), self.client_timeout_ms)
+                    if not line or line == b'\r\n':
+                        break
+                    if line[:15].lower() == b'content-length:':
+                        content_length = int(line[15:].strip())
+                    elif line[:11].lower() == b'connection:':
+                        value = line[11:].strip().lower()
+                        if value == b'close':
+                            keep_alive = False
+                        elif value == b'keep-alive':
+                            keep_alive = True
+                    elif line[:7].lower() == b'expect:':
+                        expect_continue = b'100-continue' in line.lower()
+                    elif line[:8].lower() == b'x-crc32:':
+                        crc_header = line[8:].strip().decode('utf-8')
+                
+                if request[:4] == b'PUT ':
+                    # Uploads stream their body to flash instead of buffering it;
+                    # a refused one leaves its body unread, so the connection closes
+                    status, result = await self.receive_file(reader, writer, request.decode('utf-8'),
+                                                             content_length, expect_continue, crc_header)
+                    keep_alive = keep_alive and status == 200
+                elif content_length > self.max_body_bytes:
+                    # Small bodies only (e.g. a playlist); larger ones are refused unread
+                    status, result = 413, None
+                    keep_alive = False
+                else:
+                    body = None
+                    if content_length:
+                        body = await asyncio.wait_for_ms(reader.readexactly(content_length), self.client_timeout_ms)
+                    status, result = await self.handle_request(request.decode('utf-8'), body)
+                
+                # Rendered into the shared response buffer; write() copies what it can't send at once
+                writer.write(self.responses.render(status, result, keep_alive))
+                await asyncio.wait_for_ms(writer.drain(), self.client_timeout_ms)
+                if not keep_alive:
+                    return
+                served += 1
+        except asyncio.TimeoutError:
+            print("Client timed out")
+        except Exception as e:
+            print(f"Error serving client: {e}")
+        finally:
+            self.clients -= 1
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def receive_file(self, reader, writer, request, content_length, expect_continue=False, crc_header=None):
+        """
+        PUT /files/<name>: stream the request body into the stimulus library.
+
+        The body is read in upload_chunk_bytes pieces into one preallocated
+        buffer and appended to <name>.part while a CRC-32 is updated, so the
+        file never has to fit in RAM. If the client sent an X-CRC32 header (or
+        ?crc32=, hex) it must match; the part file then replaces <name> with a
+        single rename, so a failed or aborted upload leaves the old stimulus
+        intact. Refused while audio is playing, as flash writes stall the
+        other core. Returns (status code, JSON payload).
+        """
+        started_us = time.ticks_us()
+        status = 200
+        part = None
+        try:
+            parsed = self.parse_request(request)
+            filename = parsed.get('path', '')[7:]
+            crc_text = crc_header or parsed.get('params', {}).get('crc32')
+            try:
+                expected = int(crc_text, 16) if crc_text else None
+            except ValueError:
+                expected = None
+            if 'error' in parsed or not parsed['path'].startswith('/files/'):
+                status = 405
+                result = {'status': 'error', 'message': 'PUT is only supported for /files/<name>'}
+            elif not filename or '/' in filename or filename.startswith('.') or stimulus_kind(filename) is None:
+                status = 400
+                result = {'status': 'error', 'message': 'File name must be a plain <name>.wav, .adpcm or .raw'}
+            elif content_length <= 0:
+                status = 411
+                result = {'status': 'error', 'message': 'Send the file with a Content-Length'}
+            elif crc_text and expected is None:
+                status = 400
+                result = {'status': 'error', 'message': 'CRC-32 must be hexadecimal'}
+            elif expected is not None and crc32 is None:
+                # a requested integrity check that can't be done must not pass
+                status = 501
+                result = {'status': 'error', 'message': 'CRC-32 check requested but not available on this firmware'}
+            elif not self.begin_upload():
+                status = 409
+                result = {'status': 'error', 'message': 'Busy: playback, calibration or another upload in progress'}
+            else:
+                replaced = None
+                try:
+                    path = f"{self.upload_dir}/{filename}"
+                    try:
+                        os.mkdir(self.upload_dir)
+                    except OSError:
+                        pass
+                    fs = os.statvfs(self.upload_dir)
+                    if fs[0] * fs[3] < content_length + len(self.upload_buffer):
+                        status = 507
+                        result = {'status': 'error', 'message': f'{content_length} bytes do not fit in {fs[0] * fs[3]} free'}
+                    else:
+                        if expect_continue:
+                            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+                            await asyncio.wait_for_ms(writer.drain(), self.client_timeout_ms)
+                        part = path + ".part"
+                        crc = 0
+                        remaining = content_length
+                        buf = memoryview(self.upload_buffer)
+                        with open(part, "wb") as f:
+                            while remaining:
+                                view = buf if remaining >= len(buf) else buf[:remaining]
+                                n = await asyncio.wait_for_ms(reader.readinto(view), self.client_timeout_ms)
+                                if not n:
+                                    raise OSError("connection closed mid-upload")
+                                if n < len(view):
+                                    view = view[:n]
+                                f.write(view)
+                                if crc32 is not None:
+                                    crc = crc32(view, crc)
+                                remaining -= n
+                        if expected is not None and crc != expected:
+                            status = 400
+                            result = {'status': 'error', 'message': f'CRC mismatch: got {crc:08x}, expected {expected:08x}'}
+                        else:
+                            # littlefs renames over an existing file atomically; FAT needs it removed first
+                            try:
+                                os.rename(part, path)
+                            except OSError:
+                                os.remove(path)
+                                os.rename(part, path)
+                            part = None
+                            replaced = path
+                            result = {'status': 'success', 'path': path, 'bytes': content_length,
+                                      'crc32': f'{crc:08x}' if crc32 is not None else None}
+                            if self.library is not None:
+                                try:
+                                    result['name'] = self.library.add(filename)
+                                except (OSError, ValueError) as e:
+                                    result['message'] = f'Stored but not indexed: {e}'
+                finally:
+                    self.end_upload(replaced)
+        except asyncio.TimeoutError:
+            status = 408
+            result = {'status': 'error', 'message': 'Upload timed out'}
+        except Exception as e:
+            print(f"Error receiving file: {e}")
+            status = 500
+            result = {'status': 'error', 'message': f'Upload failed: {e}'}
+        finally:
+            if part is not None:
+                try:
+                    os.remove(part)
+                except OSError:
+                    pass
+            if self.metrics is not None:
+                self.metrics.request('/files', time.ticks_diff(time.ticks_us(), started_us))
+        return status, result
+
+    async def handle_request(self, request, body=None):
+        """Handle an HTTP request line (and optional body); returns (status code, JSON payload or None)"""
+        started_us = time.ticks_us()
+        parsed = {'path': None}
         try:
-            # Receive request
-            request = client_sock.recv(1024).decode('utf-8')
-            if not request:
-                return
-            
             # Parse the request
             parsed = self.parse_request(request)
             
             # Prepare response
-            response = "HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n\r\n"
+            status = 200
+            result = None
             
             # Handle different endpoints
             if 'error' in parsed:
-                response += json.dumps({'status': 'error', 'message': parsed['error']})
+                result = {'status': 'error', 'message': parsed['error']}
 
             elif parsed['path'] == '/play':
-                # Handle play command
-                duration = float(parsed['params'].get('duration', 5.0))
-                volume = float(parsed['params'].get('volume', 0.5))
-                
-                # Check if audio is already playing
-                with self.play_request_lock:
-                    if self.audio_playing:
+                # Handle play command: starts now if idle, otherwise queued gaplessly
+                try:
+                    play_request = self.make_play_request(parsed['params'])
+                    queued = self.enqueue_play_requests([play_request])
+                    if queued is None:
                         # Reject the request with 409 Conflict status
-                        response = "HTTP/1.1 409 Conflict\r\nContent-Type: application/json\r\n\r\n"
-                        response += json.dumps({
+                        status = 409
+                        result = {
                             'status': 'error', 
-                            'message': 'Audio already playing, request rejected'
-                        })
-                    else:
-                        # Set play request and mark as playing
-                        self.play_request = {
-                            'duration': duration,
-                            'volume': volume
+                            'message': 'Play queue full or upload in progress, request rejected'
                         }
-                        self.audio_playing = True
-                        
-                        response += json.dumps({
+                    else:
+                        result = {
                             'status': 'success', 
-                            'message': f'Play request set: duration={duration}s, volume={volume}'
-                        })
+                            'queued': queued,
+                            'message': f"Play request set: source={play_request['source']}, duration={play_request['duration']}s, volume_left={play_request['volume_left']}, volume_right={play_request['volume_right']}"
+                        }
+                except ValueError as e:
+                    status = 400
+                    result = {'status': 'error', 'message': f'Invalid play request: {e}'}
+            
+            elif parsed['path'] == '/playlist':
+                # Queue a list of segments rendered back-to-back
+                if parsed['method'] != 'POST' or not body:
+                    status = 400
+                    result = {'status': 'error', 'message': 'POST a JSON body: {"segments": [...]}'}
+                else:
+                    try:
+                        playlist = json.loads(body)
+                        segments = playlist['segments'] if isinstance(playlist, dict) else None
+                        if not isinstance(segments, list) or not all(isinstance(seg, dict) for seg in segments):
+                            raise ValueError('segments must be a list of objects')
+                        segments = [self.make_play_request(seg) for seg in segments]
+                        if not segments:
+                            raise ValueError('empty playlist')
+                        queued = self.enqueue_play_requests(segments)
+                    except (ValueError, KeyError, TypeError) as e:
+                        segments = None
+                        status = 400
+                        result = {'status': 'error', 'message': f'Invalid playlist: {e}'}
+                    if segments:
+                        if queued is None:
+                            status = 409
+                            result = {
+                                'status': 'error',
+                                'message': f'Playlist does not fit in the play queue (max {self.max_queue}) or upload in progress'
+                            }
+                        else:
+                            result = {
+                                'status': 'success',
+                                'segments': len(segments),
+                                'queued': queued
+                            }
+            
+            elif parsed['path'] == '/stop':
+                # Preempt playback; "immediate" mutes without the release ramp
+                immediate = parsed['params'].get('immediate', '0').lower() in ('1', 'true', 'yes')
+                requested_us = time.ticks_us()
+                was_playing = self.request_stop(immediate)
+                
+                # Wait for the audio loop to report the actual stop time
+                if was_playing:
+                    while self.audio_playing and time.ticks_diff(time.ticks_us(), requested_us) < self.stop_timeout_ms * 1000:
+                        await asyncio.sleep_ms(1)
+                
+                stopped = not self.audio_playing
+                stop_us = self.last_stop_us if (was_playing and stopped) else None
+                result = {
+                    'status': 'success' if stopped else 'error',
+                    'was_playing': was_playing,
+                    'stopped': stopped,
+                    'requested_ticks_us': requested_us,
+                    'stop_ticks_us': stop_us,
+                    'frames_played': self.last_frames_played if stop_us is not None else None,
+                    'latency_us': time.ticks_diff(stop_us, requested_us) if stop_us is not None else None
+                }
             
             elif parsed['path'] == '/led':
                 # Handle LED control
@@ -219,126 +742,452 @@ class WiFiController:
                 
                 if led_num == 0:  # Control all LEDs
                     self.set_all_leds(state)
-                    response += json.dumps({'status': 'success', 'message': f'All LEDs set to {state}'})
+                    result = {'status': 'success', 'message': f'All LEDs set to {state}'}
                 elif 1 <= led_num <= 4:
                     self.set_led(led_num, state)
-                    response += json.dumps({'status': 'success', 'message': f'LED {led_num} set to {state}'})
+                    result = {'status': 'success', 'message': f'LED {led_num} set to {state}'}
                 else:
-                    response += json.dumps({'status': 'error', 'message': f'Invalid LED number: {led_num}'})
+                    result = {'status': 'error', 'message': f'Invalid LED number: {led_num}'}
             
             elif parsed['path'] == '/gain':
                 # Handle gain control (0-3)
                 try:
                     gain_level = int(parsed['params'].get('level', 0))
-                    if 0 <= gain_level <= 3:
-                        # Set gain request using semaphore
-                        with self.play_request_lock:
-                            self.gain_request = gain_level
+                    if self.control is None:
+                        result = {'status': 'error', 'message': 'Control block not available'}
+                    elif 0 <= gain_level <= 3:
+                        # Applied by the audio loop at the next buffer (or at once when idle)
+                        self.control.update(gain=gain_level)
                         
-                        response += json.dumps({
+                        result = {
                             'status': 'success', 
                             'message': f'Gain level set to {gain_level}'
-                        })
+                        }
                     else:
-                        response += json.dumps({
+                        result = {
                             'status': 'error', 
                             'message': f'Invalid gain level: {gain_level}. Must be 0-3.'
-                        })
+                        }
                 except ValueError:
-                    response += json.dumps({
+                    result = {
                         'status': 'error', 
                         'message': 'Gain level must be a number (0-3)'
-                    })
+                    }
+            
+            elif parsed['path'] == '/control':
+                # Live master volume, L/R balance and amp gain, applied at the next buffer
+                if self.control is None:
+                    result = {'status': 'error', 'message': 'Control block not available'}
+                else:
+                    params = parsed['params']
+                    try:
+                        volume = float(params['volume']) if 'volume' in params else None
+                        balance = float(params['balance']) if 'balance' in params else None
+                        gain = int(params['gain']) if 'gain' in params else None
+                        ramp_ms = int(params.get('ramp_ms', self.config["audio"].get("volume_ramp_ms", 0)))
+                        if volume is not None and volume > 1.0:
+                            raise ValueError('volume must be 0.0..1.0 (negative: follow the play request)')
+                        if balance is not None and not -1.0 <= balance <= 1.0:
+                            raise ValueError('balance must be -1.0..1.0')
+                        if gain is not None and not 0 <= gain <= 3:
+                            raise ValueError('gain must be 0-3')
+                        if ramp_ms < 0:
+                            raise ValueError('ramp_ms must be >= 0')
+                    except ValueError as e:
+                        status = 400
+                        result = {'status': 'error', 'message': f'Invalid control request: {e}'}
+                    else:
+                        if volume is not None or balance is not None or gain is not None:
+                            self.control.update(volume, balance, gain, ramp_ms)
+                        report = self.control.snapshot()
+                        report['status'] = 'success'
+                        result = report
+            
+            elif parsed['path'] == '/calibrate':
+                # Auto-tune playback_frames/dma_buffer_frames while idle; result in /status
+                if self.request_calibration():
+                    result = {
+                        'status': 'success',
+                        'message': 'Calibration started, see /status for the result'
+                    }
+                else:
+                    status = 409
+                    result = {'status': 'error', 'message': 'Busy: playback or calibration in progress'}
+            
+            elif parsed['path'] == '/library':
+                # List the stimuli indexed at boot
+                if self.library is None:
+                    result = {'status': 'error', 'message': 'Library not available'}
+                else:
+                    result = {
+                        'status': 'success',
+                        'directory': self.library.directory,
+                        'stimuli': self.library.listing()
+                    }
+            
+            elif parsed['path'] == '/trace':
+                # Drain the per-write playback trace recorded since the last call
+                if self.trace is None:
+                    result = {'status': 'error', 'message': 'Trace not available'}
+                else:
+                    try:
+                        limit = int(parsed['params'].get('limit', 0)) or None
+                    except ValueError:
+                        limit = None
+                    records = self.trace.drain(limit)
+                    result = {
+                        'status': 'success',
+                        'fields': TRACE_FIELDS,
+                        'records': records,
+                        'dropped': self.trace.dropped
+                    }
+            
+            elif parsed['path'] == '/metrics':
+                # Playback health and request latency counters
+                if self.metrics is None:
+                    result = {'status': 'error', 'message': 'Metrics not available'}
+                else:
+                    report = self.metrics.snapshot()
+                    if self.pipeline is not None and self.pipeline.ring is not None:
+                        report['pipeline'] = self.pipeline.ring.snapshot()
+                    report['status'] = 'success'
+                    result = report
             
             elif parsed['path'] == '/status':
                 # Return system status
-                response += json.dumps({
+                result = {
                     'status': 'success',
                     'wifi_connected': self.wifi_connected,
                     'server_running': self.server_running,
+                    'calibrating': self.calibrating,
+                    'calibration': self.calibration,
+                    'last_frames_played': self.last_frames_played,
                     'ip_address': self.wlan.ifconfig()[0] if self.wifi_connected else 'Not connected'
-                })
+                }
             
             else:
                 # Unknown endpoint
-                response += json.dumps({'status': 'error', 'message': f'Unknown endpoint: {parsed["path"]}'})
+                result = {'status': 'error', 'message': f'Unknown endpoint: {parsed["path"]}'}
             
-            # Send response
-            client_sock.send(response)
+            return status, result
         except Exception as e:
             print(f"Error handling request: {e}")
-            try:
-                client_sock.send("HTTP/1.1 500 Internal Server Error\r\n\r\n")
-            except:
-                pass
+            return 500, None
         finally:
-            client_sock.close()
+            if self.metrics is not None:
+                self.metrics.request(parsed.get('path'), time.ticks_diff(time.ticks_us(), started_us))
     
     def check_play_request(self):
-        """Check if there's a pending play request, and return it if present"""
+        """Pop the next queued play request (playlist segment), or None if the queue is empty"""
+        if not self.play_queue:
+            return None
         with self.play_request_lock:
-            request = self.play_request
-            self.play_request = None
-            return request
+            if not self.play_queue:
+                return None
+            self.playback_started = True
+            return self.play_queue.pop(0)
             
-    def check_gain_request(self):
-        """Check if there's a pending gain change request, and return it if present"""
+    def request_stop(self, immediate=False):
+        """Ask the audio loop to stop and drop queued segments; returns whether audio was playing"""
         with self.play_request_lock:
-            request = self.gain_request
-            self.gain_request = None
+            was_playing = self.audio_playing
+            if was_playing:
+                # A stop also cancels queued segments
+                self.play_queue = []
+                if self.playback_started:
+                    self.stop_request = 'immediate' if immediate else 'fade'
+                else:
+                    # The audio loop hasn't taken anything yet (e.g. it is
+                    # calibrating): cancelling the queue is the whole stop
+                    self.audio_playing = False
+                    self.last_stop_us = time.ticks_us()
+                    self.last_frames_played = 0
+            return was_playing
+
+    def check_volume_request(self):
+        """Return and clear a pending (volume_left, volume_right, ramp_ms) change, or None"""
+        if self.volume_request is None:
+            return None
+        with self.play_request_lock:
+            request = self.volume_request
+            self.volume_request = None
             return request
-    
-    def server_loop(self):
-        """Main server loop - accepts and processes client connections"""
-        while True:
-            if not self.wifi_connected:
-                self.wifi_connected = self.connect_wifi()
-                if not self.wifi_connected:
-                    # Failed to connect - blink all LEDs as a warning
-                    while not self.wifi_connected:
-                        self.set_all_leds(True)
-                        time.sleep_ms(500)
-                        self.set_all_leds(False)
-                        time.sleep_ms(500)
-                        self.wifi_connected = self.connect_wifi()
-            
-            if self.wifi_connected and not self.server_running:
-                self.server_running = self.start_server()
+
+    def check_stop_request(self):
+        """Return and clear a pending stop request ('fade' or 'immediate'), or None"""
+        if self.stop_request is None:
+            return None
+        with self.play_request_lock:
+            request = self.stop_request
+            self.stop_request = None
+            return request
+
+    def playback_finished(self, stop_us, frames_played=None):
+        """
+        Called by the audio loop when playback ends; stop_us is the device mute
+        time, frames_played the stimulus frames delivered (None if not counted)
+        """
+        with self.play_request_lock:
+            self.last_stop_us = stop_us
+            self.last_frames_played = frames_played
+            self.stop_request = None
+            self.playback_started = False
+            # A segment queued after the audio loop's last check is still pending
+            self.audio_playing = bool(self.play_queue)
             
+    def request_calibration(self):
+        """Ask the audio loop to run a buffer calibration; False if it is busy"""
+        with self.play_request_lock:
+            if self.audio_playing or self.calibrating or self.uploading:
+                return False
+            self.calibrate_request = True
+            self.calibrating = True
+            return True
+
+    def begin_upload(self):
+        """Claim the flash for a file upload; False if audio or another upload is busy"""
+        with self.play_request_lock:
+            if self.audio_playing or self.calibrating or self.uploading:
+                return False
+            self.uploading = True
+            return True
+
+    def end_upload(self, replaced=None):
+        """Release the upload claim; 'replaced' is the path written, if any"""
+        with self.play_request_lock:
+            self.uploading = False
+            if replaced is not None:
+                self.replaced_files.append(replaced)
+
+    def check_replaced_files(self):
+        """Return and clear the paths rewritten by uploads (their open players are stale)"""
+        if not self.replaced_files:
+            return None
+        with self.play_request_lock:
+            replaced = self.replaced_files
+            self.replaced_files = []
+            return replaced
+
+    def check_calibrate_request(self):
+        """Return and clear a pending calibration request"""
+        if not self.calibrate_request:
+            return False
+        with self.play_request_lock:
+            self.calibrate_request = False
+            return True
+
+    def calibration_finished(self, result):
+        """Called by the audio loop with the calibration result (see HardwareController.calibrate)"""
+        with self.play_request_lock:
+            self.calibration = result
+            self.calibrating = False
+
+    async def ensure_wifi(self):
+        """Connect to WiFi, blinking all LEDs as a warning until it succeeds"""
+        self.wifi_connected = await self.connect_wifi()
+        while not self.wifi_connected:
+            self.set_all_leds(True)
+            await asyncio.sleep_ms(500)
+            self.set_all_leds(False)
+            await asyncio.sleep_ms(500)
+            self.wifi_connected = await self.connect_wifi()
+
+    async def heartbeat_task(self):
+        """Low-priority task: briefly blink LED 3 to show the server is running"""
+        while True:
+            await asyncio.sleep_ms(self.heartbeat_ms)
             if self.server_running:
+                self.set_led(3, True)
+                await asyncio.sleep_ms(50)
+                self.set_led(3, False)
+
+    async def gc_task(self):
+        """Low-priority task: periodic garbage collection, off the request path"""
+        while True:
+            await asyncio.sleep_ms(self.gc_interval_ms)
+            gc.collect()
+            if self.metrics is not None:
+                self.metrics.heap(gc.mem_free())
+
+    async def wifi_watchdog_task(self):
+        """Restart the server after a WiFi drop"""
+        while True:
+            await asyncio.sleep_ms(self.wifi_check_ms)
+            if not self.wlan.isconnected():
+                print("WiFi connection lost")
+                self.wifi_connected = False
+                await self.stop_server()
+                await self.ensure_wifi()
+                await self.start_server()
+
+    def open_sync_socket(self):
+        """Bind the non-blocking UDP clock-sync socket (sync_port 0 disables it)"""
+        if not self.sync_port:
+            return False
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(socket.getaddrinfo('0.0.0.0', self.sync_port)[0][-1])
+            sock.setblocking(False)
+            self.sync_socket = sock
+            print(f"Clock sync listening on UDP port {self.sync_port}")
+            return True
+        except Exception as e:
+            print(f"Failed to open clock sync socket: {e}")
+            return False
+
+    async def sync_task(self):
+        """
+        NTP-style clock sync: each datagram's first 8 bytes (the host's t0) are
+        echoed back followed by the device ticks_us at receive (t1) and at send (t2),
+        as '<8sII'. The host derives the offset from its send/receive times and
+        keeps the sample with the smallest round trip. ticks_us wraps at 2**30.
+        """
+        sock = self.sync_socket
+        reply = bytearray(16)
+        while True:
+            await _readable(sock)
+            try:
+                data, addr = sock.recvfrom(32)
+            except OSError:
+                continue
+            t1 = time.ticks_us()
+            if len(data) < 8:
+                continue
+            reply[0:8] = data[0:8]
+            struct.pack_into('<I', reply, 8, t1)
+            struct.pack_into('<I', reply, 12, time.ticks_us())
+            try:
+                sock.sendto(reply, addr)
+            except OSError:
+                pass
+
+    def open_control_socket(self):
+        """Bind the non-blocking UDP command socket (control_port 0 disables it)"""
+        if not self.control_port:
+            return False
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind(socket.getaddrinfo('0.0.0.0', self.control_port)[0][-1])
+            sock.setblocking(False)
+            self.control_socket = sock
+            print(f"UDP commands listening on port {self.control_port}")
+            return True
+        except Exception as e:
+            print(f"Failed to open UDP command socket: {e}")
+            return False
+
+    def handle_udp_command(self, command, flags, payload):
+        """Execute one binary command; returns an ACK_* status"""
+        if command == CMD_PLAY:
+            if len(payload) < UDP_PLAY_SIZE:
+                return ACK_BAD_PACKET
+            source, play_flags, duration_ms, vl, vr, freq_a, freq_b, at = struct.unpack_from(UDP_PLAY, payload)
+            if source >= len(UDP_SOURCES):
+                return ACK_BAD_PACKET
+            params = {
+                'source': UDP_SOURCES[source],
+                'duration': duration_ms / 1000,
+                'volume': vl / 32767,
+                'volume_left': vl / 32767,
+                'volume_right': vr / 32767,
+            }
+            if play_flags & UDP_PLAY_FLAG_AT:
+                params['at'] = at
+            if source == 1 and freq_b:
+                params['min_frequency'] = freq_a
+                params['max_frequency'] = freq_b
+            elif source == 2 and freq_a:
+                params['tones'] = [(freq_a, 1.0, 'both')]
+                if freq_b:
+                    params['tones'].append((freq_b, 1.0, 'both'))
+            try:
+                request = self.make_play_request(params)
+            except ValueError:
+                return ACK_BAD_PACKET
+            try:
+                queued = self.enqueue_play_requests([request])
+            except ValueError:
+                return ACK_REJECTED
+            return ACK_OK if queued is not None else ACK_REJECTED
+
+        if command == CMD_STOP:
+            immediate = len(payload) >= 1 and payload[0] != 0
+            return ACK_OK if self.request_stop(immediate) else ACK_REJECTED
+
+        if command == CMD_GAIN:
+            if len(payload) < 1 or payload[0] > 3:
+                return ACK_BAD_PACKET
+            if self.control is None:
+                return ACK_REJECTED
+            self.control.update(gain=payload[0])
+            return ACK_OK
+
+        if command == CMD_VOLUME:
+            if len(payload) < 6:
+                return ACK_BAD_PACKET
+            vl, vr, ramp_ms = struct.unpack_from('<HHH', payload)
+            with self.play_request_lock:
+                self.volume_request = (vl / 32767, vr / 32767, ramp_ms)
+            return ACK_OK
+
+        return ACK_BAD_PACKET
+
+    async def control_task(self):
+        """Serve binary UDP commands with a preallocated ack buffer"""
+        sock = self.control_socket
+        ack = bytearray(10)
+        last_addr = None
+        last_seq = -1
+        last_status = ACK_OK
+        while True:
+            await _readable(sock)
+            try:
+                data, addr = sock.recvfrom(64)
+            except OSError:
+                continue
+            if len(data) < UDP_HEADER_SIZE:
+                continue
+            magic, command, flags, seq = struct.unpack_from(UDP_HEADER, data)
+            if magic != UDP_MAGIC:
+                continue
+            if addr == last_addr and seq == last_seq:
+                # retransmission: acknowledge again, don't execute twice
+                status = last_status
+            else:
                 try:
-                    # Set socket timeout to allow periodic reconnection check
-                    self.socket.settimeout(1.0)
-                    try:
-                        client_sock, addr = self.socket.accept()
-                        # Reset timeout for this client connection
-                        client_sock.settimeout(3.0)
-                        self.handle_request(client_sock, addr)
-                    except OSError as e:
-                        # Socket timeout - normal during accept()
-                        pass
-                    
-                    # Briefly blink LED 1 to show server is running
-                    self.set_led(3, True)
-                    time.sleep_ms(50)
-                    self.set_led(3, False)
-                    
-                    # Check if WiFi is still connected
-                    if not self.wlan.isconnected():
-                        print("WiFi connection lost")
-                        self.wifi_connected = False
-                        self.server_running = False
-                        try:
-                            self.socket.close()
-                        except:
-                            pass
+                    status = self.handle_udp_command(command, flags, memoryview(data)[UDP_HEADER_SIZE:])
                 except Exception as e:
-                    print(f"Server error: {e}")
-                    self.server_running = False
-            
-            # Give other tasks a chance to run
-            time.sleep_ms(50)
-            gc.collect()  # Periodic garbage collection
+                    print(f"Error handling UDP command: {e}")
+                    status = ACK_BAD_PACKET
+                last_addr = addr
+                last_seq = seq
+                last_status = status
+            struct.pack_into(UDP_ACK, ack, 0, UDP_MAGIC, command | 0x80, status, seq, time.ticks_us())
+            try:
+                sock.sendto(ack, addr)
+            except OSError:
+                pass
+
+    async def serve(self):
+        """Bring up WiFi and the server, then run housekeeping tasks alongside it"""
+        for coro in self.tasks:
+            asyncio.create_task(coro)
+        await self.ensure_wifi()
+        while not await self.start_server():
+            await asyncio.sleep_ms(1000)
+        if self.open_sync_socket():
+            asyncio.create_task(self.sync_task())
+        if self.open_control_socket():
+            asyncio.create_task(self.control_task())
+        asyncio.create_task(self.heartbeat_task())
+        asyncio.create_task(self.gc_task())
+        await self.wifi_watchdog_task()
+
+    def server_loop(self):
+        """Run the asyncio event loop (clients are served concurrently)"""
+        asyncio.run(self.serve())
     
     def start(self):
         """Start the WiFi controller in a new thread on the second core"""
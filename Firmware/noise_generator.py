@@ -0,0 +1,143 @@
+import math
+import micropython
+from array import array
+
+# --------------------
+# xorshift32 white noise through a band-pass in fixed point, written as
+# identical L/R samples into 32-bit stereo frames.
+# state is a ptr32 block (see _NS_* indices):
+#   [rng, hp_state, lp_state, a_hp, a_lp, makeup_q8]
+# The band-pass is a one-pole high-pass at min_frequency cascaded with a one-pole
+# low-pass at max_frequency (a second-order band-pass). Filter states carry 8
+# fractional bits; coefficients are Q15 and multiplied in two halves so nothing
+# overflows 32 bits.
+@micropython.viper
+def _viper_noise(dst: ptr32, frames: int, state: ptr32):
+    r = uint(state[0])
+    s1 = state[1]
+    s2 = state[2]
+    a_hp = state[3]
+    a_lp = state[4]
+    makeup = state[5]
+    i = int(0)
+    while i < frames:
+        # xorshift32
+        r ^= r << 13
+        r ^= r >> 17
+        r ^= r << 5
+        x = int(r >> 16)
+        x = ((x ^ 0x8000) - 0x8000) << 8
+        # high-pass: subtract a slow one-pole low-pass
+        d = x - s1
+        s1 += (d >> 15) * a_hp + (((d & 0x7FFF) * a_hp) >> 15)
+        h = x - s1
+        # low-pass
+        d = h - s2
+        s2 += (d >> 15) * a_lp + (((d & 0x7FFF) * a_lp) >> 15)
+        y = ((s2 >> 8) * makeup) >> 8
+        # saturate
+        if y > 32767:
+            y = 32767
+        elif y < -32768:
+            y = -32768
+        dst[i] = (y & 0xFFFF) | (y << 16)
+        i += 1
+    state[0] = int(r)
+    state[1] = s1
+    state[2] = s2
+
+
+# state block layout shared with _viper_noise
+_NS_RNG = 0
+_NS_HP = 1
+_NS_LP = 2
+_NS_A_HP = 3
+_NS_A_LP = 4
+_NS_MAKEUP = 5
+
+# RMS of full-scale uniform white noise relative to full scale (1/sqrt(3))
+_UNIFORM_RMS = 0.57735
+
+
+class NoiseGenerator:
+    """
+    On-device white / band-limited stochastic noise source with the same
+    generate_buffer(desired_frames) contract as RawFilePlayer.
+
+    Noise comes from a xorshift32 PRNG and is band-limited between min_frequency
+    and max_frequency (same meaning as noiseMinFrequency/noiseMaxFrequency in the
+    Simulator). Without a band (min 0, max >= Nyquist) the output is white.
+    'level' is the target RMS as a fraction of full scale; band-limited output is
+    boosted to roughly that level and saturates on rare peaks.
+
+    Output is 16-bit stereo with identical L/R samples. Returned buffers are only
+    valid until the next call.
+    """
+    def __init__(self, config, min_frequency=None, max_frequency=None, level=None, seed=None):
+        self.config = config
+        self.audio_cfg = config["audio"]
+        self.sample_rate = self.audio_cfg["sample_rate"]
+        if self.audio_cfg["bits_per_sample"] != 16 or self.audio_cfg.get("channels", 2) != 2:
+            raise ValueError("NoiseGenerator produces 16-bit stereo only")
+        self.frame_size = 4
+
+        if seed is None:
+            seed = self.audio_cfg.get("noise_seed", 0x2545)
+        # xorshift must never be seeded with 0
+        seed &= 0xFFFFFFFF
+        if seed == 0:
+            seed = 0x2545
+        # the generator word is a uint32 held in a signed array slot
+        self.state = array('i', [seed - (1 << 32) if seed & 0x80000000 else seed, 0, 0, 0, 32767, 256])
+
+        if level is None:
+            level = self.audio_cfg.get("noise_level", 0.25)
+        self.level = level
+
+        if min_frequency is None:
+            min_frequency = self.audio_cfg.get("noise_min_frequency", 0)
+        if max_frequency is None:
+            max_frequency = self.audio_cfg.get("noise_max_frequency", self.sample_rate // 2)
+        self.set_band(min_frequency, max_frequency)
+
+        # Output buffer (allocated on first generate_buffer call)
+        self.buffer = None
+        self.view = None
+        self.buf_bytes = 0
+
+    def _one_pole(self, frequency):
+        """Q15 coefficient of a one-pole low-pass with the given corner frequency."""
+        return int((1.0 - math.exp(-2.0 * math.pi * frequency / self.sample_rate)) * 32767)
+
+    def set_band(self, min_frequency, max_frequency):
+        """
+        Set the noise band in Hz. Filter states are kept, so this can be called
+        between buffers without a discontinuity.
+        """
+        nyquist = self.sample_rate / 2
+        if min_frequency < 0 or max_frequency <= min_frequency:
+            raise ValueError("Noise band must satisfy 0 <= min_frequency < max_frequency")
+        max_frequency = min(max_frequency, nyquist)
+        self.min_frequency = min_frequency
+        self.max_frequency = max_frequency
+
+        st = self.state
+        st[_NS_A_HP] = self._one_pole(min_frequency) if min_frequency > 0 else 0
+        st[_NS_A_LP] = self._one_pole(max_frequency) if max_frequency < nyquist else 32767
+
+        # Makeup gain: band power scales with bandwidth relative to Nyquist
+        bandwidth = max(max_frequency - min_frequency, 1)
+        makeup = (self.level / _UNIFORM_RMS) * math.sqrt(nyquist / bandwidth)
+        st[_NS_MAKEUP] = max(1, min(int(makeup * 256), 4095))
+
+    def generate_buffer(self, desired_frames):
+        """
+        Returns a memoryview for the next stereo buffer of 'desired_frames'.
+        """
+        num_bytes = desired_frames * self.frame_size
+        if self.buf_bytes != num_bytes:
+            self.buffer = bytearray(num_bytes)
+            self.view = memoryview(self.buffer)
+            self.buf_bytes = num_bytes
+        _viper_noise(self.buffer, desired_frames, self.state)
+        return self.view
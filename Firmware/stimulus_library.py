@@ -0,0 +1,118 @@
+import os
+import struct
+from wav_file_player import wav_info
+from adpcm_file_player import ADPCM_MAGIC, ADPCM_HEADER, ADPCM_HEADER_SIZE
+
+# index entry layout: (path, format, size_bytes, frames, loop_start, loop_end)
+ENTRY_FIELDS = ('path', 'format', 'size', 'frames', 'loop_start', 'loop_end')
+
+_FORMATS = {'.wav': 'wav', '.adpcm': 'adpcm', '.raw': 'raw'}
+
+
+def stimulus_kind(filename):
+    """Library format of 'filename' from its extension ('wav', 'adpcm', 'raw'), or None"""
+    dot = filename.rfind('.')
+    return _FORMATS.get(filename[dot:].lower()) if dot > 0 else None
+
+
+class StimulusLibrary:
+    """
+    Boot-time index of the stimulus files in audio.library_dir.
+
+    scan() reads every .wav/.adpcm/.raw header once and keeps a compact tuple per
+    stimulus, keyed by file name without extension, so /play?name= is a single
+    dict lookup with no filesystem access. Files whose format doesn't match
+    config["audio"] are left out (and reported on the console).
+
+    Loop points come from a WAV 'smpl' chunk; otherwise the whole file loops.
+    """
+    def __init__(self, config):
+        self.config = config
+        self.audio_cfg = config["audio"]
+        self.directory = self.audio_cfg.get("library_dir", "stimuli")
+        self.index = {}
+        self.frame_size = (self.audio_cfg["bits_per_sample"] // 8) * self.audio_cfg.get("channels", 2)
+
+    def _probe(self, path, kind):
+        """Return an index entry for one file, or raise ValueError"""
+        with open(path, "rb") as f:
+            if kind == 'wav':
+                _, size, audio_format, rate, bits, channels, loop = wav_info(f, path)
+                if audio_format != 1:
+                    raise ValueError("not PCM")
+                if (rate, bits, channels) != (self.audio_cfg["sample_rate"],
+                                              self.audio_cfg["bits_per_sample"],
+                                              self.audio_cfg.get("channels", 2)):
+                    raise ValueError(f"{rate} Hz/{bits}-bit/{channels} ch does not match config")
+                frames = size // self.frame_size
+            elif kind == 'adpcm':
+                header = f.read(ADPCM_HEADER_SIZE)
+                if len(header) < ADPCM_HEADER_SIZE:
+                    raise ValueError("short header")
+                magic, _, _, _, rate, frames = struct.unpack(ADPCM_HEADER, header)
+                if magic != ADPCM_MAGIC:
+                    raise ValueError("not an IMA-ADPCM file")
+                if rate != self.audio_cfg["sample_rate"]:
+                    raise ValueError(f"{rate} Hz does not match config")
+                f.seek(0, 2)
+                size = f.tell()
+                loop = None
+            else:
+                f.seek(0, 2)
+                size = f.tell()
+                frames = size // self.frame_size
+                loop = None
+        if not frames:
+            raise ValueError("empty")
+        if loop is None or not 0 <= loop[0] < min(loop[1], frames):
+            loop = (0, frames)
+        return (path, kind, size, frames, loop[0], min(loop[1], frames))
+
+    def scan(self):
+        """(Re)build the index from the library directory; returns the number of stimuli"""
+        index = {}
+        try:
+            entries = list(os.ilistdir(self.directory))
+        except OSError:
+            print(f"Stimulus library: no directory {self.directory}")
+            entries = []
+        for entry in entries:
+            name = entry[0]
+            if entry[1] == 0x4000:
+                continue  # subdirectory
+            kind = stimulus_kind(name)
+            if kind is None:
+                continue
+            path = f"{self.directory}/{name}"
+            try:
+                index[name[:name.rfind('.')]] = self._probe(path, kind)
+            except (OSError, ValueError) as e:
+                print(f"Stimulus library: skipping {name}: {e}")
+        self.index = index
+        print(f"Stimulus library: {len(index)} stimuli in {self.directory}")
+        return len(index)
+
+    def add(self, filename):
+        """
+        (Re)index one file of the library directory, e.g. after an upload, and
+        return its stimulus name. Raises ValueError (and drops any stale entry)
+        if the file can't be played with the current config.
+        """
+        kind = stimulus_kind(filename)
+        if kind is None:
+            raise ValueError(f"{filename}: not a .wav/.adpcm/.raw file")
+        name = filename[:filename.rfind('.')]
+        try:
+            self.index[name] = self._probe(f"{self.directory}/{filename}", kind)
+        except (OSError, ValueError):
+            self.index.pop(name, None)
+            raise
+        return name
+
+    def lookup(self, name):
+        """Index entry for 'name', or None"""
+        return self.index.get(name)
+
+    def listing(self):
+        """The index as a JSON-ready dict: name -> {path, format, size, frames, loop_start, loop_end}"""
+        return {name: dict(zip(ENTRY_FIELDS, entry)) for name, entry in self.index.items()}
@@ -0,0 +1,140 @@
+import math
+import micropython
+from array import array
+
+# sine lookup table: 1024 entries of signed 16-bit, indexed by the top 10 bits
+# of a 30-bit phase accumulator (30 bits keep every constant a small int)
+_LUT_BITS = 10
+_LUT_SIZE = 1 << _LUT_BITS
+_PHASE_BITS = 30
+_PHASE_ONE = 1 << _PHASE_BITS
+
+# maximum number of summed tones
+MAX_TONES = 8
+
+# channel masks
+CHANNEL_LEFT = 1
+CHANNEL_RIGHT = 2
+CHANNEL_BOTH = 3
+_CHANNELS = {'left': CHANNEL_LEFT, 'right': CHANNEL_RIGHT, 'both': CHANNEL_BOTH}
+
+# --------------------
+# direct digital synthesis: sum of sine tones into 32-bit stereo frames
+# tones is a ptr32 block: [count, (phase, increment, amp_q15, channel_mask) * count]
+# phase is a 30-bit accumulator; the top 10 bits index the LUT and the next
+# 15 bits linearly interpolate to the following entry.
+@micropython.viper
+def _viper_dds(dst: ptr32, frames: int, lut: ptr16, tones: ptr32):
+    n = tones[0]
+    i = int(0)
+    while i < frames:
+        l = 0
+        r = 0
+        t = 0
+        while t < n:
+            b = 1 + t * 4
+            ph = tones[b]
+            idx = ph >> 20
+            frac = (ph >> 5) & 0x7FFF
+            v0 = ((lut[idx] ^ 0x8000) - 0x8000)
+            v1 = ((lut[(idx + 1) & 0x3FF] ^ 0x8000) - 0x8000)
+            s = v0 + (((v1 - v0) * frac) >> 15)
+            s = (s * tones[b + 2]) >> 15
+            mask = tones[b + 3]
+            if mask & 1:
+                l += s
+            if mask & 2:
+                r += s
+            tones[b] = (ph + tones[b + 1]) & 0x3FFFFFFF
+            t += 1
+        # saturate
+        if l > 32767:
+            l = 32767
+        elif l < -32768:
+            l = -32768
+        if r > 32767:
+            r = 32767
+        elif r < -32768:
+            r = -32768
+        dst[i] = (l & 0xFFFF) | (r << 16)
+        i += 1
+
+
+def _build_lut():
+    lut = array('H', [0] * _LUT_SIZE)
+    for k in range(_LUT_SIZE):
+        lut[k] = int(round(32767 * math.sin(2 * math.pi * k / _LUT_SIZE))) & 0xFFFF
+    return lut
+
+
+class ToneGenerator:
+    """
+    Phase-accumulator sine / multi-tone generator with the same
+    generate_buffer(desired_frames) contract as RawFilePlayer.
+
+    Each tone has a frequency (Hz), an amplitude (0.0..1.0 of full scale) and a
+    channel ('left', 'right' or 'both'); tones routed to the same channel are
+    summed and saturated. Defaults to a single tone from config["audio"]
+    ("frequency", and "amplitude" as a Q15 integer).
+
+    Output is 16-bit stereo. Returned buffers are only valid until the next call.
+    """
+    _lut = None
+
+    def __init__(self, config, tones=None):
+        self.config = config
+        self.audio_cfg = config["audio"]
+        self.sample_rate = self.audio_cfg["sample_rate"]
+        if self.audio_cfg["bits_per_sample"] != 16 or self.audio_cfg.get("channels", 2) != 2:
+            raise ValueError("ToneGenerator produces 16-bit stereo only")
+        self.frame_size = 4
+
+        # The LUT is shared by every instance
+        if ToneGenerator._lut is None:
+            ToneGenerator._lut = _build_lut()
+
+        self.tones = array('i', [0] * (1 + 4 * MAX_TONES))
+        if tones is None:
+            tones = [(self.audio_cfg.get("frequency", 440),
+                      self.audio_cfg.get("amplitude", 32767) / 32767,
+                      'both')]
+        self.set_tones(tones)
+
+        # Output buffer (allocated on first generate_buffer call)
+        self.buffer = None
+        self.view = None
+        self.buf_bytes = 0
+
+    def set_tones(self, tones):
+        """
+        Replace the tone set with a list of (frequency, amplitude, channel) tuples.
+        Phases restart at zero.
+        """
+        if not 1 <= len(tones) <= MAX_TONES:
+            raise ValueError(f"Between 1 and {MAX_TONES} tones are supported")
+        nyquist = self.sample_rate / 2
+        block = self.tones
+        for t, (frequency, amplitude, channel) in enumerate(tones):
+            if not 0 < frequency < nyquist:
+                raise ValueError(f"Tone frequency must be between 0 and {nyquist} Hz")
+            if channel not in _CHANNELS:
+                raise ValueError(f"Invalid tone channel: {channel}")
+            amp = int(amplitude * 32767)
+            b = 1 + t * 4
+            block[b] = 0
+            block[b + 1] = int(frequency * _PHASE_ONE / self.sample_rate)
+            block[b + 2] = max(0, min(amp, 32767))
+            block[b + 3] = _CHANNELS[channel]
+        block[0] = len(tones)
+
+    def generate_buffer(self, desired_frames):
+        """
+        Returns a memoryview for the next stereo buffer of 'desired_frames'.
+        """
+        num_bytes = desired_frames * self.frame_size
+        if self.buf_bytes != num_bytes:
+            self.buffer = bytearray(num_bytes)
+            self.view = memoryview(self.buffer)
+            self.buf_bytes = num_bytes
+        _viper_dds(self.buffer, desired_frames, ToneGenerator._lut, self.tones)
+        return self.view
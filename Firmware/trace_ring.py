@@ -0,0 +1,68 @@
+from array import array
+
+# record layout: one row of FIELDS integers per I2S write
+FIELDS = ('ticks_ms', 'dt_us', 'gap_us', 'bytes', 'free')
+_NFIELDS = 5
+
+
+class TraceRing:
+    """
+    Fixed-size, preallocated ring of integer playback trace records.
+
+    The audio loop calls record() once per I2S write; it only stores integers into
+    an array, so tracing costs next to nothing and never allocates. Readers drain
+    lazily (drain() from the /trace endpoint, or print_records() on demand).
+
+    Single producer, single consumer: the producer only advances 'head' and the
+    consumer only advances 'tail'. Records overwritten before they were drained
+    are counted as dropped.
+    """
+    def __init__(self, size=256):
+        self.size = size
+        self.data = array('i', [0] * (size * _NFIELDS))
+        self.head = 0   # total records written
+        self.tail = 0   # total records drained
+        self.dropped = 0
+
+    def record(self, ticks_ms, dt_us, gap_us, nbytes, free):
+        i = (self.head % self.size) * _NFIELDS
+        d = self.data
+        d[i] = ticks_ms
+        d[i + 1] = dt_us
+        d[i + 2] = gap_us
+        d[i + 3] = nbytes
+        d[i + 4] = free
+        self.head += 1
+
+    def drain(self, limit=None):
+        """
+        Return the records written since the last drain as a list of tuples
+        (oldest first, at most 'limit'), and advance the read position.
+        """
+        head = self.head
+        tail = self.tail
+        if head - tail > self.size:
+            self.dropped += head - tail - self.size
+            tail = head - self.size
+        if limit is not None and head - tail > limit:
+            head = tail + limit
+        rows = []
+        d = self.data
+        for n in range(tail, head):
+            i = (n % self.size) * _NFIELDS
+            rows.append(tuple(d[i:i + _NFIELDS]))
+        # the producer may have lapped us while copying: drop what it overwrote
+        overrun = self.head - self.size - tail
+        if overrun > 0:
+            rows = rows[overrun:]
+            self.dropped += overrun
+        self.tail = head
+        return rows
+
+    def print_records(self, limit=None):
+        """Drain and print records over serial (for on-demand debugging)"""
+        print(','.join(FIELDS))
+        for row in self.drain(limit):
+            print(','.join(str(v) for v in row))
+        if self.dropped:
+            print(f"# dropped={self.dropped}")
@@ -1,13 +1,76 @@
 import os
+import gc
+import struct
+
+
+def wav_info(f, filename):
+    """
+    Parse the RIFF/WAVE header of open file 'f'. Returns a tuple
+    (data_offset, data_bytes, audio_format, sample_rate, bits, channels, loop)
+    where loop is (start_frame, end_frame) from the first 'smpl' chunk loop, or
+    None. Raises ValueError for files that are not RIFF/WAVE.
+    """
+    header = f.read(12)
+    if len(header) < 12 or header[0:4] != b'RIFF' or header[8:12] != b'WAVE':
+        raise ValueError(f"{filename}: not a RIFF/WAVE file")
+    fmt = None
+    loop = None
+    data = None
+    pos = 12
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+        pos += 8
+        if chunk_id == b'fmt ':
+            fmt = f.read(min(chunk_size, 40))
+        elif chunk_id == b'smpl' and chunk_size >= 60:
+            smpl = f.read(60)
+            # first loop: cue id, type, start, end (inclusive), fraction, play count
+            if struct.unpack_from('<I', smpl, 28)[0]:
+                start, end = struct.unpack_from('<II', smpl, 44)
+                loop = (start, end + 1)
+        elif chunk_id == b'data':
+            data = (pos, chunk_size)
+        # chunks are word aligned
+        pos += chunk_size + (chunk_size & 1)
+        f.seek(pos)
+
+    if fmt is None or len(fmt) < 16:
+        raise ValueError(f"{filename}: missing fmt chunk")
+    if data is None:
+        raise ValueError(f"{filename}: no data chunk")
+    audio_format, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', fmt)
+    # WAVE_FORMAT_EXTENSIBLE: the sub-format GUID starts with the real format tag
+    if audio_format == 0xFFFE and len(fmt) >= 26:
+        audio_format = struct.unpack_from('<H', fmt, 24)[0]
+    # a truncated file may end before the declared data size
+    f.seek(0, 2)
+    size = min(data[1], f.tell() - data[0])
+    f.seek(0, 0)
+    return data[0], size, audio_format, sample_rate, bits, channels, loop
+
 
 class RawFilePlayer:
     """
     Triple-buffered raw PCM file player with per-buffer byte offset tracking to avoid glitches.
     Assumes the input is a raw PCM file with interleaved samples.
 
+    The three buffers are preallocated once per buffer size and refilled with readinto(),
+    so steady-state streaming allocates nothing. Buffers returned by generate_buffer are
+    only valid until the next call and must be treated as read-only by the caller.
+
+    In resident mode the whole file is loaded into RAM once at construction and buffers
+    are served as memoryview slices of that image, so the hot loop never touches flash.
+    If gc.mem_free() shows the file would not fit, the player falls back to streaming.
+
+    'loop' is an optional (start_frame, end_frame) region: playback runs from the start
+    of the data and then repeats [start_frame, end_frame) instead of the whole file.
+
     Audio format parameters (sample_rate, bits_per_sample, channels) are read from config["audio"].
     """
-    def __init__(self, filename, config):
+    def __init__(self, filename, config, resident=None, loop=None):
         self.config = config
         self.audio_cfg = config["audio"]
         self.filename = filename
@@ -22,36 +85,160 @@ class RawFilePlayer:
         self.sample_size = self.bits_per_sample // 8
         self.frame_size = self.sample_size * self.channels  # bytes per frame
 
-        # Open raw PCM file and determine its size
+        # Open the file and locate the PCM data (the whole file for raw PCM)
         self.file = open(self.filename, "rb")
-        self.file.seek(0, 2)
-        self.data_size = self.file.tell()
-        self.file.seek(0, 0)
+        try:
+            self.data_offset, self.data_size = self._locate_data()
+        except Exception:
+            self.file.close()
+            raise
         self.byte_position = 0
 
-        # Triple-buffer storage
-        self.buffers = [bytearray(), bytearray(), bytearray()]
+        # Loop region in bytes: wrap to loop_start once data_size is reached
+        self.loop_start = 0
+        if loop is not None:
+            start, end = loop
+            end = min(end * self.frame_size, self.data_size)
+            if not 0 <= start * self.frame_size < end:
+                self.file.close()
+                raise ValueError(f"{filename}: invalid loop region {loop}")
+            self.data_size = end
+            self.loop_start = start * self.frame_size
+
+        # Triple-buffer storage (allocated on first generate_buffer call)
+        self.buffers = []
+        self.views = []
         self.current = 0
         self.buf_bytes = 0
 
-    def _read_chunk(self, pos, size):
+        # Optional whole-file RAM image (resident mode)
+        self.image = None
+        self.image_mv = None
+        self.wrap_buf = None
+        self.wrap_mv = None
+        if resident is None:
+            resident = self.audio_cfg.get("resident", False)
+        if resident:
+            self._load_resident()
+
+    def rewind(self):
         """
-        Read 'size' bytes from file at byte offset 'pos', wrapping around if needed.
+        Restart from the beginning of the data (the loop region is kept), e.g.
+        when a cached player is reused for a new request. Streaming buffers
+        already allocated are refilled from the start.
         """
+        self.byte_position = 0
+        self.current = 0
+        if self.image is None and self.buf_bytes:
+            for i in range(3):
+                self._read_into(self.views[i], i * self.buf_bytes)
+
+    def _locate_data(self):
+        """Return (byte offset, byte length) of the PCM samples in the file."""
+        self.file.seek(0, 2)
+        size = self.file.tell()
+        self.file.seek(0, 0)
+        return 0, size
+
+    def close(self):
+        """Release the file handle (the player can't stream afterwards)."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _load_resident(self):
+        """
+        Read the whole file into a bytearray if it fits in free heap (minus headroom).
+        Leaves the player in streaming mode otherwise.
+        """
+        headroom = self.audio_cfg.get("resident_headroom_bytes", 32768)
+        gc.collect()
+        free = gc.mem_free()
+        if self.data_size + headroom > free:
+            print(f"{self.filename}: {self.data_size} bytes won't fit in RAM "
+                  f"(free={free}, headroom={headroom}); streaming from flash")
+            return
+
+        image = bytearray(self.data_size)
+        self.file.seek(self.data_offset)
+        got = self.file.readinto(image) or 0
+        if got != self.data_size:
+            print(f"{self.filename}: short read ({got}/{self.data_size}); streaming from flash")
+            return
+
+        self.image = image
+        self.image_mv = memoryview(image)
+        # The RAM image replaces all flash access
+        self.file.close()
+        self.file = None
+        print(f"{self.filename}: loaded {self.data_size} bytes into RAM")
+
+    @property
+    def resident(self):
+        """True when buffers are served from the in-RAM image."""
+        return self.image is not None
+
+    def _wrap(self, pos):
+        """Map a byte position past the end of the data back into the loop region."""
+        if pos < self.data_size:
+            return pos
+        start = self.loop_start
+        return start + (pos - start) % (self.data_size - start)
+
+    def _resident_buffer(self, num_bytes):
+        """
+        Return the next 'num_bytes' of the RAM image as a memoryview slice.
+        A chunk that crosses the end of the image is stitched into a reused wrap buffer.
+        """
+        pos = self.byte_position
+        end = pos + num_bytes
+        if end <= self.data_size:
+            mv = self.image_mv[pos:end]
+        else:
+            if self.wrap_buf is None or len(self.wrap_buf) != num_bytes:
+                self.wrap_buf = bytearray(num_bytes)
+                self.wrap_mv = memoryview(self.wrap_buf)
+            filled = 0
+            while filled < num_bytes:
+                n = min(self.data_size - pos, num_bytes - filled)
+                self.wrap_mv[filled:filled + n] = self.image_mv[pos:pos + n]
+                filled += n
+                pos = self.loop_start
+            mv = self.wrap_mv
+        self.byte_position = self._wrap(end)
+        return mv
+
+    def _read_into(self, mv, pos):
+        """
+        Fill memoryview 'mv' from byte offset 'pos' of the PCM data, wrapping around
+        if needed. Only a read that crosses the end of the data creates a (short-lived) slice.
+        """
+        size = len(mv)
         # Normalize position
-        pos %= self.data_size
-        # Seek and read as much as possible
-        self.file.seek(pos)
-        chunk = bytearray(self.file.read(size))
-        # If we hit EOF before filling, wrap and continue reading
-        while len(chunk) < size:
-            need = size - len(chunk)
-            self.file.seek(0)
-            piece = self.file.read(min(self.data_size, need))
-            if not piece:
+        pos = self._wrap(pos)
+        # Seek and read as much as possible, stopping at the end of the data
+        self.file.seek(self.data_offset + pos)
+        if pos + size <= self.data_size:
+            got = self.file.readinto(mv) or 0
+        else:
+            got = self.file.readinto(mv[:self.data_size - pos]) or 0
+        # If we hit the end before filling, wrap and continue reading
+        while got < size:
+            self.file.seek(self.data_offset + self.loop_start)
+            n = self.file.readinto(mv[got:got + min(size - got, self.data_size - self.loop_start)]) or 0
+            if not n:
                 break
-            chunk.extend(piece)
-        return bytes(chunk)
+            got += n
+
+    def _allocate_buffers(self, num_bytes):
+        """Preallocate the three buffers and their memoryviews for 'num_bytes' chunks."""
+        self.buffers = []
+        self.views = []
+        for _ in range(3):
+            buf = bytearray(num_bytes)
+            self.buffers.append(buf)
+            self.views.append(memoryview(buf))
+        self.buf_bytes = num_bytes
 
     def generate_buffer(self, desired_frames):
         """
@@ -59,24 +246,48 @@ class RawFilePlayer:
         """
         num_bytes = desired_frames * self.frame_size
 
+        if self.image is not None:
+            return self._resident_buffer(num_bytes)
+
         # On first call or if frame size changed, refill all three buffers
         if self.buf_bytes != num_bytes:
-            self.buf_bytes = num_bytes
+            self._allocate_buffers(num_bytes)
             for i in range(3):
-                pos = (self.byte_position + i * num_bytes) % self.data_size
-                self.buffers[i] = self._read_chunk(pos, num_bytes)
+                self._read_into(self.views[i], self.byte_position + i * num_bytes)
             self.current = 0
 
         # Return the current buffer
-        mv = memoryview(self.buffers[self.current])
+        mv = self.views[self.current]
 
         # Schedule refill of the buffer 2 steps ahead
         refill_idx = (self.current + 2) % 3
-        next_pos = (self.byte_position + 2 * num_bytes) % self.data_size
-        self.buffers[refill_idx] = self._read_chunk(next_pos, num_bytes)
+        self._read_into(self.views[refill_idx], self.byte_position + 2 * num_bytes)
 
         # Advance position and index
-        self.byte_position = (self.byte_position + num_bytes) % self.data_size
+        self.byte_position = self._wrap(self.byte_position + num_bytes)
         self.current = (self.current + 1) % 3
 
         return mv
+
+
+class WavFilePlayer(RawFilePlayer):
+    """
+    RawFilePlayer for RIFF/WAVE files: the header is parsed once at open, the
+    format is validated against config["audio"] (sample_rate, bits_per_sample,
+    channels) and only the 'data' chunk is streamed (or held resident), with the
+    same preallocated zero-copy buffering.
+
+    Raises ValueError for files that are not PCM WAV or don't match the config.
+    """
+    def _locate_data(self):
+        offset, size, audio_format, sample_rate, bits, channels, _ = wav_info(self.file, self.filename)
+        if audio_format != 1:
+            raise ValueError(f"{self.filename}: only PCM WAV is supported (format {audio_format})")
+        if (sample_rate, bits, channels) != (self.sample_rate, self.bits_per_sample, self.channels):
+            raise ValueError(f"{self.filename}: {sample_rate} Hz/{bits}-bit/{channels} ch does not match "
+                             f"config {self.sample_rate} Hz/{self.bits_per_sample}-bit/{self.channels} ch")
+        # whole frames only (a truncated file may end mid-frame)
+        size -= size % self.frame_size
+        if size <= 0:
+            raise ValueError(f"{self.filename}: empty data chunk")
+        return offset, size